@@ -0,0 +1,130 @@
+"""
+Headless batch re-arranger for WAZER g-code.
+
+Reorders every file it is given and writes the t_ copy next to it, the same
+as Rearrange and Save Copy in wam_decode.py, only without the GUI.
+Files are spread over a process pool, and each result is printed as one JSON
+line as soon as it is done. Every t_ file is checked against its original
+with verify_output. Exits 1 if any file didn't parse or didn't verify,
+and 2 if the targets didn't match any files at all.
+
+    python wam_batch.py /jobs/tonight
+    python wam_batch.py "/jobs/*/*.gcode" --workers 8 --mode optimize
+    python wam_batch.py /jobs/tonight --compact 0.01
+    python wam_batch.py /jobs/tonight --nesting shape
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from wam_core import optimize_travel, parse_gcode_file, rapid_distance, reorder_parts, verify_output, write_file
+
+MODES = ("rearrange", "optimize")
+NESTING = ("box", "shape")
+
+
+def find_files(targets: list[str], include_outputs: bool = False) -> list[Path]:
+    """Folders give their .gcode files, anything else is a glob. t_ files are skipped unless asked for."""
+    found = []
+    for target in targets:
+        if Path(target).is_dir():
+            found.extend(Path(target).glob("*.gcode"))
+        else:
+            found.extend(Path(x) for x in glob.glob(target))
+    found = sorted(set(found))
+    return [x for x in found if x.is_file() and (include_outputs or not x.name.startswith("t_"))]
+
+
+def process_file(filename: Path, mode: str = "rearrange", tolerance: float = 0.0, nesting: str = "box") -> dict:
+    """Parse, reorder and write one file, gives back what happened as a dict ready for JSON
+
+    A tolerance merges straight runs of G1 moves in the output, see compact_block.
+    nesting is by bounding box like the GUI, or by the shape of closed cuts like Nest by shape ticked.
+    """
+    result = {"file": str(filename), "ok": False}
+    start = time.perf_counter()
+    try:
+        header, footer, parts = parse_gcode_file(filename)
+    except (OSError, ValueError) as err:
+        result["error"] = f"{type(err).__name__}: {err}"
+        return result
+    result["parse_s"] = round(time.perf_counter() - start, 6)
+    if not all((header, footer, parts)):
+        result["error"] = "File did not parse correctly."
+        return result
+
+    start = time.perf_counter()
+    before = rapid_distance(parts)
+    shapes = nesting == "shape"
+    parts = optimize_travel(parts, shapes=shapes) if mode == "optimize" else reorder_parts(parts, shapes)
+    result["reorder_s"] = round(time.perf_counter() - start, 6)
+
+    start = time.perf_counter()
+    try:
+        compaction = write_file(filename, header, footer, parts, tolerance)
+    except OSError as err:
+        result["error"] = f"{type(err).__name__}: {err}"
+        return result
+    result["write_s"] = round(time.perf_counter() - start, 6)
+
+    start = time.perf_counter()
+    verification = verify_output(filename, tolerance=tolerance)
+    result["verify_s"] = round(time.perf_counter() - start, 6)
+    if not verification.ok:
+        result["error"] = str(verification)
+        return result
+
+    path = Path(filename)
+    result.update(
+        ok=True,
+        output=str(path.parents[0] / f"t_{path.name}"),
+        parts=len(parts),
+        rapid_before_mm=round(before, 2),
+        rapid_after_mm=round(rapid_distance(parts), 2),
+        **compaction._asdict(),
+    )
+    return result
+
+
+def main() -> int:
+    """Run the batch, exit code is 1 when any file failed and 2 when there were no files"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("targets", nargs="+", help="folders of .gcode files, or glob patterns")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes to use (default: all cpus)")
+    parser.add_argument("--mode", choices=MODES, default="rearrange", help="Rearrange or Optimize ordering")
+    parser.add_argument("--include-outputs", action="store_true", help="also process t_ files")
+    parser.add_argument("--nesting", choices=NESTING, default="box", help="what counts as one cut inside another")
+    parser.add_argument("--compact", type=float, default=0.0, metavar="MM", help="merge G1 moves straight to within MM")
+    args = parser.parse_args()
+
+    files = find_files(args.targets, args.include_outputs)
+    failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        jobs = {
+            pool.submit(process_file, filename, args.mode, args.compact, args.nesting): filename for filename in files
+        }
+        for job in as_completed(jobs):
+            try:
+                result = job.result()
+            except Exception as err:  # pylint: disable=broad-except
+                # A crash in one file (or its worker dying) is that file's failure, the rest carry on.
+                result = {"file": str(jobs[job]), "ok": False, "error": f"{type(err).__name__}: {err}"}
+            failed += not result["ok"]
+            print(json.dumps(result), flush=True)
+    summary = {"summary": True, "files": len(files), "failed": failed, "elapsed_s": round(time.perf_counter() - start, 6)}
+    print(json.dumps(summary), flush=True)
+    if not files:
+        print(f"No .gcode files found in {' '.join(args.targets)}", file=sys.stderr)
+        return 2
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,488 @@
+"""
+Benchmarks for the WAZER gcode re-arranger.
+
+Generates synthetic WAZER style g-code so things can be measured at sizes
+the real sample files never get to.
+
+    python wam_bench.py generate sheet.gcode --cuts 2000 --depth 3
+    python wam_bench.py stages --record bench_results.jsonl
+    python wam_bench.py memory --cuts 50000
+    python wam_bench.py containment --cuts 5000 --straights 50
+    python wam_bench.py ordering --sizes 1000 10000 100000
+    python wam_bench.py travel --sizes 2000 10000
+    python wam_bench.py imports
+"""
+
+import argparse
+import gc
+import json
+import math
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+import wam_core as core
+
+SYNTHETIC_HEADER = """;-------------------------------Cut file parameters------------------------
+; Input file name : synthetic.svg
+; File rotation : 0 File scale : 1
+; Material name : Aluminum, 6061
+; Material thickness : 3 mm
+; Cut path  : Centerline
+; Cut quality : roughRate
+; Raw Material width : {width:.2f}mm
+; Raw Material height : {height:.2f}mm
+;-------------------------------Do Not modify the Gcode file---------------
+G90
+G21
+M1403
+M1405 X0.00 Y-0.00
+M1406 X{width:.2f} Y-{height:.2f}
+M1407 S3.0
+M1410 1.5; Generated on Wam
+M1411 Aluminum, 6061
+M1412 3 mm
+"""
+SYNTHETIC_FOOTER = "M1413 00:00:00\nM1404\n"
+
+
+@dataclass
+class LegacyPart:
+    """The Part dataclass as it was before the array backed version, for comparison."""
+
+    points: tuple[float] = field(repr=False)
+    g_code: str = field(repr=False)
+    bbox: core.BBox
+    used: bool = False
+    children: "LegacyPart" = None
+
+    def __hash__(self):
+        return hash(self.g_code)
+
+
+def legacy_part(g_code: str) -> LegacyPart:
+    """Build a LegacyPart the way parse_gcode used to"""
+    regex = "(-?\\d+(?:\\.\\d+)?)"
+    x_points = [float(x) for x in re.findall("X" + regex, g_code)]
+    y_points = [float(y) for y in re.findall("Y" + regex, g_code)]
+    return LegacyPart(
+        points=tuple((_x, _y) for _x, _y in zip(x_points, y_points)),
+        g_code=g_code,
+        bbox=core.BBox(min(x_points), min(y_points), max(x_points), max(y_points)),
+    )
+
+
+def legacy_parts_by_row(parts: list[core.Part]):
+    """parts_by_row as it was before the binary search, for comparison."""
+    rows = []
+    reverse_it = False
+    new_parts = sorted(parts, key=lambda x: x.bbox.max_y, reverse=True)
+    while new_parts:
+        rows.append(
+            sorted(
+                [x for x in new_parts if new_parts[0].bbox.min_y < x.bbox.max_y or x == new_parts[0]],
+                key=lambda x: x.bbox.min_x,
+                reverse=reverse_it,
+            )
+        )
+        reverse_it = not reverse_it
+        [new_parts.remove(x) for x in rows[-1]]
+
+    return rows
+
+
+def synthetic_block(rnd: random.Random, points: int, c_x: float, c_y: float, radius: float) -> str:
+    """One closed cut, a wobbly circle around c_x, c_y"""
+    step = math.tau / max(points - 1, 1)
+    coords = []
+    for i in range(max(points - 1, 1)):
+        wobble = radius * rnd.uniform(0.9, 1.0)
+        coords.append((c_x + wobble * math.cos(i * step), c_y + wobble * math.sin(i * step)))
+    # Back to where it started, so it is a closed path.
+    coords.append(coords[0])
+    lines = [f"G0 X{coords[0][0]:.2f} Y{coords[0][1]:.2f}\n", "M3\n", "M8\n", "G4 S3.\n"]
+    lines.append(f"G1 X{coords[0][0]:.2f} Y{coords[0][1]:.2f} F222.08\n")
+    lines.extend(f"G1 X{x:.2f} Y{y:.2f}\n" for x, y in coords[1:])
+    lines.extend(["G4 S1.\n", "M9\n", "G4 S1.\n", "M5\n", "G4 S1.\n"])
+    return "".join(lines)
+
+
+def synthetic_gcode(
+    cuts: int,
+    points: int = 20,
+    seed: int = 0,
+    depth: int = 1,
+    width: float = core.CUT_WIDTH_MM,
+    height: float = core.CUT_HEIGHT_MM,
+    straights: int = 0,
+    left: float = 0.0,
+    top: float = 0.0,
+) -> str:
+    """A whole WAZER file with the given number of cuts
+
+    Cuts shrink as there get to be more of them, so a big count is a sheet of
+    small parts, not a pile of parts on top of each other.
+    With a depth over 1 the cuts come in groups of depth circles, one inside the
+    other, the outside one first in the file like the worst case for re-ordering.
+    straights adds that many pairs of straight cuts, a short one then a longer one
+    it lies along, boxes with no area for nesting to get right.
+    left and top move the whole sheet away from the origin, in mm.
+    """
+    rnd = random.Random(seed)
+    groups = math.ceil(cuts / max(depth, 1))
+    max_radius = min(20, math.sqrt(width * height / max(groups, 1)) / 4)
+    blocks = []
+    while len(blocks) < cuts:
+        radius = rnd.uniform(max_radius / 10, max_radius)
+        c_x = left + rnd.uniform(radius, width - radius)
+        c_y = -top - rnd.uniform(radius, height - radius)
+        for _ in range(min(max(depth, 1), cuts - len(blocks))):
+            blocks.append(synthetic_block(rnd, points, c_x, c_y, radius))
+            # Wobble takes up to 10% off, so 0.8 of the radius is always well inside.
+            radius *= 0.8
+    for _ in range(straights):
+        length = rnd.uniform(5, 50)
+        x_1, y_pos = left + rnd.uniform(0, width - length), -top - rnd.uniform(0, height)
+        blocks.append(straight_block(x_1 + length / 4, x_1 + length / 2, y_pos))
+        blocks.append(straight_block(x_1, x_1 + length, y_pos))
+    return SYNTHETIC_HEADER.format(width=width, height=height) + "".join(blocks) + SYNTHETIC_FOOTER
+
+
+def straight_block(x_1: float, x_2: float, y_pos: float) -> str:
+    """One open cut, a horizontal line from x_1 to x_2"""
+    lines = [f"G0 X{x_1:.2f} Y{y_pos:.2f}\n", "M3\n", "M8\n", "G4 S3.\n"]
+    lines.append(f"G1 X{x_1:.2f} Y{y_pos:.2f} F222.08\n")
+    lines.append(f"G1 X{x_2:.2f} Y{y_pos:.2f}\n")
+    lines.extend(["G4 S1.\n", "M9\n", "G4 S1.\n", "M5\n", "G4 S1.\n"])
+    return "".join(lines)
+
+
+def profile(stage) -> tuple[float, int]:
+    """Seconds for one call of stage(), then its peak traced bytes from a second call.
+
+    Two calls so the timing doesn't pay for tracemalloc, every stage has to be repeatable.
+    """
+    gc.collect()
+    start = time.perf_counter()
+    stage()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    stage()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def preview_all(parts: list[core.Part], tolerance: float):
+    """What draw_parts works out before handing the points to Tk, from scratch every time"""
+    for part in parts:
+        part.simplified = (0.0, ())
+        part.preview(tolerance)
+
+
+def stage_benchmark(size: int, points: int, depth: int, folder: Path) -> dict[str, tuple[float, int]]:
+    """Seconds and peak bytes of every stage of a load, reorder, draw and save, for one size"""
+    source = folder / f"synthetic_{size}.gcode"
+    source.write_text(synthetic_gcode(size, points, depth=depth), encoding="utf-8")
+    header, footer, parts = core.parse_gcode_file(source)
+    # Half a pixel of a 1000 pixel wide bed, about what the GUI draws at.
+    tolerance = core.CUT_WIDTH_MM / 2000
+    stages = {
+        "parse": lambda: core.parse_gcode_file(source),
+        "nest": lambda: core.nest_parts(parts),
+        "by_row": lambda: core.parts_by_row(parts),
+        "reorder": lambda: core.reorder_parts(parts),
+        "preview": lambda: preview_all(parts, tolerance),
+        "write": lambda: core.write_file(source, header, footer, parts),
+    }
+    return {name: profile(stage) for name, stage in stages.items()}
+
+
+def scaling(small: tuple[int, float], large: tuple[int, float]) -> float:
+    """Exponent of the time growth between two sizes, 1 is linear and 2 is quadratic"""
+    (size_1, time_1), (size_2, time_2) = small, large
+    if min(time_1, time_2) <= 0 or size_1 == size_2:
+        return float("nan")
+    return math.log(time_2 / time_1) / math.log(size_2 / size_1)
+
+
+def last_record(record: Path, points: int, depth: int) -> dict:
+    """The newest run in the record file with the same points and depth, if there is one"""
+    if not record.is_file():
+        return {}
+    previous = {}
+    for line in record.read_text(encoding="utf-8").splitlines():
+        run = json.loads(line)
+        if (run["points"], run["depth"]) == (points, depth):
+            previous = run
+    return previous
+
+
+def stages_benchmark(
+    sizes: list[int], points: int, depth: int, record: Optional[Path] = None, threshold: float = 1.5
+) -> bool:
+    """Time and memory profile each stage over the sizes, optionally recording the run.
+
+    With a record file the run is checked against the last one in it, anything more
+    than threshold times slower (and by more than 50ms) counts as a regression.
+    The scaling line is the exponent between the two biggest sizes, that one
+    doesn't care how fast the machine is.
+    """
+    results: dict[int, dict[str, tuple[float, int]]] = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for size in sizes:
+            results[size] = stage_benchmark(size, points, depth, Path(folder))
+            stages = results[size]
+            if size == sizes[0]:
+                print(f"{'parts':>8}" + "".join(f"{name + ' s':>11}{'MiB':>7}" for name in stages))
+            print(f"{size:>8}" + "".join(f"{secs:>11.4f}{peak / 2**20:>7.1f}" for secs, peak in stages.values()))
+    if len(sizes) > 1:
+        small, large = sorted(sizes)[-2:]
+        exponents = {
+            name: scaling((small, results[small][name][0]), (large, results[large][name][0])) for name in stages
+        }
+        print(f"{'scaling':>8}" + "".join(f"{exponent:>11.2f}{'':>7}" for exponent in exponents.values()))
+
+    if not record:
+        return True
+    regressions = 0
+    previous = last_record(record, points, depth).get("results", {})
+    for size, stages in results.items():
+        for name, (secs, _) in stages.items():
+            before = previous.get(str(size), {}).get(name, [None])[0]
+            if before is not None and secs > before * threshold and secs - before > 0.05:
+                print(f"regression: {name} at {size} parts, {before:.4f}s -> {secs:.4f}s")
+                regressions += 1
+    run = {
+        "when": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "points": points,
+        "depth": depth,
+        "results": {str(size): {name: list(item) for name, item in stages.items()} for size, stages in results.items()},
+    }
+    with open(record, "a", encoding="utf-8") as file:
+        print(json.dumps(run), file=file)
+    return not regressions
+
+
+def measure(build, blocks: list[tuple]) -> tuple[int, float, float]:
+    """Bytes held, build seconds and a full gc pass in seconds for build(*block) over blocks"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    parts = [build(*block) for block in blocks]
+    elapsed = time.perf_counter() - start
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.perf_counter()
+    gc.collect()
+    gc_time = time.perf_counter() - start
+    del parts
+    return held, elapsed, gc_time
+
+
+def memory_benchmark(cuts: int, points: int):
+    """Compare the array backed Part against the old dataclass.
+
+    The dataclass gets each block's text already cut out, Part gets spans into
+    the file's bytes, the way the parsers hand them over.
+    """
+    _, _, parts = core.parse_gcode(synthetic_gcode(cuts, points))
+    texts = [(part.g_code,) for part in parts]
+    spans = [(part.source, *part.span) for part in parts]
+    del parts
+    print(f"{cuts} cuts, {points} points per cut")
+    print(f"{'':12}{'MiB':>10}{'build s':>10}{'gc s':>10}")
+    for name, build, blocks in (("dataclass", legacy_part, texts), ("Part", core.make_part, spans)):
+        held, elapsed, gc_time = measure(build, blocks)
+        print(f"{name:12}{held / 2**20:10.1f}{elapsed:10.3f}{gc_time:10.3f}")
+
+
+def brute_force_enclosing(parts: list[core.Part], shapes: bool = False) -> list[set[int]]:
+    """Everything enclosing each part the slow way, every pair through a_encloses_b, or a_contains_b with shapes.
+
+    Parts with the exact same box are left out, which of those nests in the other is
+    only nest_parts' tie break, everything else has to match plain enclosing.
+    """
+    if shapes:
+        encloses = core.a_contains_b
+    else:
+
+        def encloses(outer: core.Part, inner: core.Part) -> bool:
+            return core.a_encloses_b(outer.bbox, inner.bbox)
+
+    return [
+        {other for other, outer in enumerate(parts) if outer.bbox != part.bbox and encloses(outer, part)}
+        for part in parts
+    ]
+
+
+def containment_benchmark(cuts: int, points: int, depth: int = 1, shapes: bool = False, straights: int = 0) -> bool:
+    """Time nest_parts and check the tree against the brute force pairs.
+
+    Every part's ancestors in the tree, apart from ones with the same box, have to
+    be exactly what encloses it, and the direct parents can't enclose each other.
+    """
+    _, _, parts = core.parse_gcode(synthetic_gcode(cuts, points, depth=depth, straights=straights))
+    start = time.perf_counter()
+    core.nest_parts(parts, shapes)
+    elapsed = time.perf_counter() - start
+    index = {id(part): idx for idx, part in enumerate(parts)}
+    parents: list[set[int]] = [set() for _ in parts]
+    for idx, part in enumerate(parts):
+        for child in part.children:
+            parents[index[id(child)]].add(idx)
+    print(f"{cuts} cuts, nest_parts {elapsed:.3f}s, {sum(map(bool, parents))} nested")
+
+    start = time.perf_counter()
+    expected = brute_force_enclosing(parts, shapes)
+    print(f"brute force {time.perf_counter() - start:.3f}s")
+
+    mismatched = 0
+    for idx in range(len(parts)):
+        ancestors, todo = set(), list(parents[idx])
+        while todo:
+            if (parent := todo.pop()) not in ancestors:
+                ancestors.add(parent)
+                todo.extend(parents[parent])
+        ancestors = {parent for parent in ancestors if parts[parent].bbox != parts[idx].bbox}
+        direct = all(b not in expected[a] for a in parents[idx] for b in parents[idx])
+        mismatched += ancestors != expected[idx] or not direct
+    print(f"{mismatched} parts that don't match")
+    return not mismatched
+
+
+def ordering_benchmark(sizes: list[int], points: int, legacy_limit: int = 10_000):
+    """Time parts_by_row and reorder_parts as the part count grows.
+
+    The old parts_by_row is quadratic, it only runs up to legacy_limit parts.
+    """
+    print(f"{'parts':>10}{'rows':>8}{'by_row s':>10}{'old s':>10}{'reorder s':>11}")
+    for size in sizes:
+        _, _, parts = core.parse_gcode(synthetic_gcode(size, points))
+        start = time.perf_counter()
+        rows = core.parts_by_row(parts)
+        by_row = time.perf_counter() - start
+        old = "-"
+        if size <= legacy_limit:
+            start = time.perf_counter()
+            legacy_parts_by_row(parts)
+            old = f"{time.perf_counter() - start:.3f}"
+        start = time.perf_counter()
+        core.reorder_parts(parts)
+        reorder = time.perf_counter() - start
+        print(f"{size:>10}{len(rows):>8}{by_row:>10.3f}{old:>10}{reorder:>11.3f}")
+
+
+def travel_benchmark(sizes: list[int], points: int, time_budget: float = 0.5) -> bool:
+    """Time optimize_travel on a whole sheet, and on a 20 mm cluster in the far corner of the bed.
+
+    The cluster starts the nearest neighbour search a long way from every part.
+    Anything much over time_budget means part of it isn't kept to the budget.
+    """
+    layouts = {
+        "sheet": {},
+        "corner": {"width": 20, "height": 20, "left": core.CUT_WIDTH_MM - 20, "top": core.CUT_HEIGHT_MM - 20},
+    }
+    print(f"{'layout':>8}{'parts':>10}{'seconds':>10}{'rapid before':>14}{'rapid after':>13}")
+    slow = 0
+    for size in sizes:
+        for name, layout in layouts.items():
+            _, _, parts = core.parse_gcode(synthetic_gcode(size, points, **layout))
+            before = core.rapid_distance(parts)
+            start = time.perf_counter()
+            parts = core.optimize_travel(parts, time_budget)
+            elapsed = time.perf_counter() - start
+            slow += elapsed > 2 * time_budget + 0.5
+            print(f"{name:>8}{size:>10}{elapsed:>10.3f}{before:>14.0f}{core.rapid_distance(parts):>13.0f}")
+    return not slow
+
+
+def imports_benchmark(modules: list[str], runs: int = 5):
+    """Milliseconds each import adds to a fresh interpreter, the best of runs.
+
+    Scripts only need wam_core, the GUI pulls in PySimpleGUI when it makes the window.
+    """
+
+    def best(statement: str) -> Optional[float]:
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            done = subprocess.run([sys.executable, "-c", statement], cwd=Path(__file__).parent, capture_output=True)
+            times.append(time.perf_counter() - start)
+            if done.returncode:
+                return None
+        return min(times)
+
+    bare = best("pass")
+    print(f"bare interpreter {bare * 1e3:.1f} ms")
+    for module in modules:
+        took = best(f"import {module}")
+        print(f"{module:20}" + ("not installed" if took is None else f"{(took - bare) * 1e3:>8.1f} ms"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="bench", required=True)
+    generate = sub.add_parser("generate", help="write a synthetic WAZER file")
+    generate.add_argument("output", type=Path)
+    generate.add_argument("--cuts", type=int, default=1_000)
+    generate.add_argument("--points", type=int, default=20)
+    generate.add_argument("--depth", type=int, default=1, help="cuts nested inside each other per group")
+    generate.add_argument("--width", type=float, default=core.CUT_WIDTH_MM, help="sheet width in mm")
+    generate.add_argument("--height", type=float, default=core.CUT_HEIGHT_MM, help="sheet height in mm")
+    generate.add_argument("--seed", type=int, default=0)
+    stages = sub.add_parser("stages", help="time and memory of each stage from parse to write, by size")
+    stages.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1_000, 10_000, 100_000])
+    stages.add_argument("--points", type=int, default=20)
+    stages.add_argument("--depth", type=int, default=2)
+    stages.add_argument("--record", type=Path, help="JSON lines file to check against and append this run to")
+    stages.add_argument("--threshold", type=float, default=1.5, help="slowdown that counts as a regression")
+    memory = sub.add_parser("memory", help="Part memory use against the old dataclass")
+    memory.add_argument("--cuts", type=int, default=50_000)
+    memory.add_argument("--points", type=int, default=20)
+    containment = sub.add_parser("containment", help="nest_parts timing, checked against brute force")
+    containment.add_argument("--cuts", type=int, default=5_000)
+    containment.add_argument("--points", type=int, default=20)
+    containment.add_argument("--depth", type=int, default=1)
+    containment.add_argument("--shapes", action="store_true", help="nest by outline instead of bounding box")
+    containment.add_argument("--straights", type=int, default=50, help="pairs of straight cuts along each other")
+    ordering = sub.add_parser("ordering", help="parts_by_row and reorder_parts scaling")
+    ordering.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    ordering.add_argument("--points", type=int, default=8)
+    travel = sub.add_parser("travel", help="optimize_travel time against its budget, spread out and clustered")
+    travel.add_argument("--sizes", type=int, nargs="+", default=[2_000, 10_000])
+    travel.add_argument("--points", type=int, default=8)
+    travel.add_argument("--budget", type=float, default=0.5, help="time_budget passed to optimize_travel")
+    imports = sub.add_parser("imports", help="import time of the core, the GUI module and their dependencies")
+    imports.add_argument("--modules", nargs="+", default=["wam_core", "wam_decode", "numpy", "PySimpleGUI"])
+    imports.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    if args.bench == "generate":
+        gcode = synthetic_gcode(args.cuts, args.points, args.seed, args.depth, args.width, args.height)
+        args.output.write_text(gcode, encoding="utf-8")
+    elif args.bench == "stages":
+        return 0 if stages_benchmark(args.sizes, args.points, args.depth, args.record, args.threshold) else 1
+    elif args.bench == "memory":
+        memory_benchmark(args.cuts, args.points)
+    elif args.bench == "containment":
+        return 0 if containment_benchmark(args.cuts, args.points, args.depth, args.shapes, args.straights) else 1
+    elif args.bench == "ordering":
+        ordering_benchmark(args.sizes, args.points)
+    elif args.bench == "travel":
+        return 0 if travel_benchmark(args.sizes, args.points, args.budget) else 1
+    elif args.bench == "imports":
+        imports_benchmark(args.modules, args.runs)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,273 @@
+"""
+In memory catalog of the .gcode files in a folder, for the file list and its search box.
+
+The folder is scanned once. After that only what changed gets looked at again,
+found through inotify on Linux, or by polling the folder's own mtime anywhere
+else, and every few seconds regardless in case the share doesn't update it.
+
+Searching is a substring of the name, plus key:value filters on the ; comment
+lines at the top of each file, which are only read the first time a filter
+needs them.
+
+    bracket                    names containing bracket
+    material:alum thickness:3  Aluminum parts in 3 mm, any name
+    width:130 lid              130mm wide sheets with lid in the name
+"""
+
+import ctypes
+import ctypes.util
+import fnmatch
+import os
+import re
+import struct
+import sys
+import time
+from bisect import bisect_right, insort
+from pathlib import Path
+from typing import Optional
+
+# From <sys/inotify.h>
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+# Short names for the header comments, for the search box.
+FIELDS = {
+    "material": "material name",
+    "thickness": "material thickness",
+    "width": "raw material width",
+    "height": "raw material height",
+    "quality": "cut quality",
+    "source": "input file name",
+}
+FILTER_REGEX = re.compile(r"(\w+):(\S+)")
+COMMENT_REGEX = re.compile(r";\s*(.+?)\s*:\s*(.*?)\s*$")
+HEADER_BYTES = 4096
+
+
+class InotifyWatcher:
+    """inotify on one folder through libc. Nothing runs in the background, events are read when asked for."""
+
+    MASK = (
+        IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    )
+
+    def __init__(self, folder: Path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), self.MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"can't watch {folder}")
+
+    def changes(self) -> Optional[set[str]]:
+        """Names touched since the last call, None when the whole folder has to be scanned again"""
+        names: set[str] = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    return None
+                names.add(os.fsdecode(name))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Anything but Linux, and shares inotify won't watch.
+
+    A file added, removed or renamed changes the folder's mtime, so that is all
+    that gets checked. Every interval seconds it asks for a full scan anyway, to
+    pick up files edited in place and shares that don't keep the mtime up to date.
+    """
+
+    def __init__(self, folder: Path, interval: float = 5.0):
+        self.folder = folder
+        self.interval = interval
+        self.stamp = self.stat()
+        self.scanned = time.monotonic()
+
+    def stat(self) -> Optional[tuple[int, int]]:
+        try:
+            stat = os.stat(self.folder)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_ino
+
+    def changes(self) -> Optional[set[str]]:
+        stamp = self.stat()
+        if stamp == self.stamp and time.monotonic() - self.scanned < self.interval:
+            return set()
+        self.stamp, self.scanned = stamp, time.monotonic()
+        return None
+
+    def close(self):
+        pass
+
+
+def watch(folder: Path, interval: float = 5.0):
+    """inotify where there is one, polling where there isn't"""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folder)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(folder, interval)
+
+
+def read_header_fields(path: Path) -> dict[str, str]:
+    """The key : value comment lines at the top of a WAZER file, keys in lower case"""
+    try:
+        with open(path, "rb") as f_handle:
+            text = f_handle.read(HEADER_BYTES).decode("utf-8", errors="replace")
+    except OSError:
+        return {}
+    fields = {}
+    for line in text.splitlines():
+        if not line.startswith(";"):
+            break
+        if match := COMMENT_REGEX.match(line):
+            fields[match[1].lower()] = match[2]
+    return fields
+
+
+class FolderCatalog:
+    """The .gcode files of one folder, kept sorted and searchable, up to date through a watcher.
+
+    Names match the way glob("*.gcode") did for list_files, hidden files are left out.
+    Header fields are cached with the size and mtime they were read at, so an edited
+    file gets read again.
+    """
+
+    def __init__(self, folder, pattern: str = "*.gcode", interval: float = 5.0):
+        self.folder = Path(folder)
+        self.pattern = pattern
+        self.entries: dict[str, tuple[int, int]] = {}
+        self.names: list[str] = []
+        self.headers: dict[str, tuple[tuple[int, int], dict[str, str]]] = {}
+        self.blob = ""
+        self.starts: list[int] = []
+        self.stale = True
+        self.watcher = watch(self.folder, interval)
+        self.rescan()
+
+    def wanted(self, name: str) -> bool:
+        return not name.startswith(".") and fnmatch.fnmatch(name, self.pattern)
+
+    def rescan(self):
+        """Look at the whole folder, only the names that changed get touched"""
+        found = {}
+        try:
+            with os.scandir(self.folder) as scan:
+                for entry in scan:
+                    if self.wanted(entry.name) and entry.is_file():
+                        stat = entry.stat()
+                        found[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            pass
+        for name in self.entries.keys() - found.keys():
+            self.remove(name)
+        for name, stamp in found.items():
+            if name not in self.entries:
+                insort(self.names, name)
+                self.stale = True
+            self.entries[name] = stamp
+
+    def update(self, name: str):
+        """Look at one name again, after the watcher said it changed"""
+        try:
+            stat = (self.folder / name).stat()
+        except OSError:
+            stat = None
+        if not self.wanted(name) or stat is None or not (self.folder / name).is_file():
+            self.remove(name)
+            return
+        if name not in self.entries:
+            insort(self.names, name)
+            self.stale = True
+        self.entries[name] = (stat.st_size, stat.st_mtime_ns)
+
+    def remove(self, name: str):
+        if self.entries.pop(name, None) is not None:
+            del self.names[bisect_right(self.names, name) - 1]
+            self.stale = True
+        self.headers.pop(name, None)
+
+    def refresh(self):
+        """Catch up with whatever the watcher has seen"""
+        changes = self.watcher.changes()
+        if changes is None:
+            self.rescan()
+        else:
+            for name in changes:
+                self.update(name)
+
+    def fields(self, name: str) -> dict[str, str]:
+        """Header fields of a file, read the first time they are asked for"""
+        stamp = self.entries.get(name)
+        cached = self.headers.get(name)
+        if cached is None or cached[0] != stamp:
+            cached = self.headers[name] = (stamp, read_header_fields(self.folder / name))
+        return cached[1]
+
+    def matching_names(self, needle: str) -> list[str]:
+        """Names containing needle, ignoring case.
+
+        All the names live in one newline separated string, so the scan is str.find
+        and a binary search per hit, not a Python loop over every name.
+        """
+        if not needle:
+            return list(self.names)
+        if self.stale:
+            lowered = [name.lower() for name in self.names]
+            self.blob = "\n".join(lowered)
+            self.starts = []
+            pos = 0
+            for name in lowered:
+                self.starts.append(pos)
+                pos += len(name) + 1
+            self.stale = False
+        found = []
+        pos = self.blob.find(needle.lower())
+        while pos >= 0:
+            idx = bisect_right(self.starts, pos) - 1
+            found.append(self.names[idx])
+            if idx + 1 >= len(self.starts):
+                break
+            pos = self.blob.find(needle.lower(), self.starts[idx + 1])
+        return found
+
+    def search(self, text: str = "") -> list[str]:
+        """Sorted names for what was typed in the search box, see the module doc"""
+        self.refresh()
+        filters = [(FIELDS.get(key.lower(), key.lower()), value.lower()) for key, value in FILTER_REGEX.findall(text)]
+        names = self.matching_names(FILTER_REGEX.sub("", text).strip())
+        if filters:
+            names = [
+                name
+                for name in names
+                if all(value in self.fields(name).get(field, "").lower() for field, value in filters)
+            ]
+        return names
+
+    def close(self):
+        self.watcher.close()
@@ -0,0 +1,1128 @@
+"""
+Parsing, geometry and ordering for WAZER generated g-code.
+
+Everything wam_decode.py does to a file, without any of the GUI, so it can
+be used from scripts and wam_batch.py without dragging in PySimpleGUI.
+"""
+
+import hashlib
+import heapq
+import math
+import mmap
+import re
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque, namedtuple
+from itertools import chain
+from pathlib import Path
+from typing import Hashable, Iterable, Iterator, Optional, Sequence
+
+# GCode constants for WAM gcode files
+# These constants were all aquired from https://wam.wazer.com/wazercam/wazercam.min.js
+# WAZER can change them when ever they want, so there be dragons.
+HEADER_REGEX = "(.*\n)+?M1412 .*\n"
+BLOCK_START_REGEX = "G0 X-?(\\d+(?:\\.\\d+)?) Y-?(\\d+(?:.\\d+)?)\n"
+BLOCK_MIDDLE_REGEX = "(.*\n)+?"
+BLOCK_END_REGEX = "G4 S1.\nM5\nG4 S1.\n"
+FOOTER_REGEX = "M1413 .*(.*\n)+"
+# Byte level versions of the regexes above, used by the single pass parser.
+# The leading newlines keep them to the start of a line.
+HEADER_END = b"\nM1412 "
+FOOTER_START = b"\nM1413 "
+BLOCK_START_LINE = re.compile(b"^" + BLOCK_START_REGEX.encode(), re.MULTILINE)
+BLOCK_END = b"\n" + BLOCK_END_REGEX.encode()
+POINT_REGEX = re.compile(rb"X(-?\d+(?:\.\d+)?) Y(-?\d+(?:\.\d+)?)")
+FEED_REGEX = re.compile(rb"F(\d+(?:\.\d+)?)")
+DWELL_REGEX = re.compile(rb"G4 S(\d+(?:\.\d+)?)")
+G1_LINE = re.compile(rb"G1 X(-?\d+(?:\.\d+)?) Y(-?\d+(?:\.\d+)?)(.*)")
+ESTIMATE_REGEX = re.compile(r"M1413 (\d+):(\d\d):(\d\d)")
+# A path that ends this close to where it started is closed, and can have parts inside it.
+CLOSED_TOLERANCE_MM = 0.05
+# Straight enough to merge G1 moves when saving with Compact on, well under the kerf.
+COMPACT_TOLERANCE_MM = 0.01
+# Not in the WAZER code, a guess at the G0 speed. Rapids are a small part of a job next to cutting.
+RAPID_MM_PER_MIN = 1200.0
+CUT_WIDTH_MM = 457
+CUT_HEIGHT_MM = 304
+
+BBox = namedtuple("BBox", "min_x, min_y, max_x, max_y")
+ToolpathStats = namedtuple("ToolpathStats", "cut_mm, rapid_mm, pierces, dwell_s, seconds")
+Compaction = namedtuple("Compaction", "lines_removed, bytes_saved")
+
+
+class Verification(namedtuple("Verification", "header_ok, footer_ok, blocks, missing, duplicated, altered")):
+    """What verify_output found. Block numbers count from 1, in the file they are from.
+
+    missing are blocks of the original the output doesn't have enough copies of,
+    duplicated are output blocks that are extra copies, and altered are output
+    blocks that aren't in the original at all.
+    """
+
+    __slots__ = ()
+
+    @property
+    def ok(self) -> bool:
+        return self.header_ok and self.footer_ok and not (self.missing or self.duplicated or self.altered)
+
+    def __str__(self):
+        if self.ok:
+            return f"Verified, {self.blocks} blocks, header and footer match"
+        checks = (("header", self.header_ok), ("footer", self.footer_ok))
+        problems = [f"{name} differs" for name, same in checks if not same]
+        for name in ("missing", "duplicated", "altered"):
+            if numbers := getattr(self, name):
+                shown = ", ".join(map(str, numbers[:10])) + (", ..." if len(numbers) > 10 else "")
+                problems.append(f"{len(numbers)} {name} blocks ({shown})")
+        return "NOT verified, " + ", ".join(problems)
+
+
+class Part:
+    """Minimum data required to easily deal with g-code sections.
+
+    Coordinates live flat in an array('d') as x0, y0, x1, y1, ... instead of a
+    tuple of tuples, dense engravings have a LOT of points.
+    The g-code isn't copied out either, a part is a (start, end) span into the
+    bytes of the whole file, which every part of the file shares.
+    Parts hash and compare by identity, two identical cuts are still two cuts.
+    """
+
+    __slots__ = ("coords", "source", "span", "bbox", "used", "children", "simplified", "moves")
+
+    def __init__(
+        self,
+        coords: array,
+        source: bytes,
+        span: tuple[int, int],
+        bbox: BBox = None,
+        used: bool = False,
+        children: list = None,
+    ):
+        self.coords = coords
+        self.source = source
+        self.span = span
+        self.bbox = bbox or BBox(min(coords[0::2]), min(coords[1::2]), max(coords[0::2]), max(coords[1::2]))
+        self.used = used
+        self.children = children
+        self.simplified: tuple[float, tuple] = (0.0, ())
+        self.moves: Optional[tuple[tuple[tuple[int, float], ...], float]] = None
+
+    @property
+    def start(self) -> tuple[float, float]:
+        """Where the G0 leaves the head"""
+        return self.coords[0], self.coords[1]
+
+    @property
+    def end(self) -> tuple[float, float]:
+        """Where the cut finishes"""
+        return self.coords[-2], self.coords[-1]
+
+    @property
+    def points(self) -> tuple[tuple[float, float]]:
+        """The (x, y) pairs, built on demand for drawing"""
+        return tuple(zip(self.coords[0::2], self.coords[1::2]))
+
+    def preview(self, tolerance: float) -> tuple[tuple[float, float]]:
+        """The (x, y) pairs simplified for display, anything within tolerance of the line is dropped.
+
+        Only for drawing, worked out once per tolerance and kept. The g-code is never touched.
+        """
+        if self.simplified[0] != tolerance or not self.simplified[1]:
+            coords = simplify(self.coords, tolerance)
+            self.simplified = (tolerance, tuple(zip(coords[0::2], coords[1::2])))
+        return self.simplified[1]
+
+    def motion(self) -> tuple[tuple[tuple[int, float], ...], float]:
+        """Where the feed changes as (point index, F) pairs, and the seconds of G4 dwell.
+
+        Read from the block the first time it's asked for, and kept.
+        """
+        if self.moves is None:
+            block = bytes(self.data)
+            # The F sits on the line of the point it moves to, the X's before it count the points.
+            feeds = tuple(
+                (block.count(b"X", 0, match.start()) - 1, float(match[1])) for match in FEED_REGEX.finditer(block)
+            )
+            self.moves = (feeds, sum(map(float, DWELL_REGEX.findall(block))))
+        return self.moves
+
+    @property
+    def g_code(self) -> str:
+        """The text of the block, decoded on demand"""
+        return bytes(self.source[self.span[0] : self.span[1]]).decode("utf-8")
+
+    @property
+    def data(self) -> memoryview:
+        """The bytes of the block, without copying them"""
+        return memoryview(self.source)[self.span[0] : self.span[1]]
+
+    def __len__(self):
+        return len(self.coords) // 2
+
+    def __repr__(self):
+        return f"Part(bbox={self.bbox!r}, used={self.used!r}, children={self.children!r})"
+
+
+def simplify(coords: array, tolerance: float) -> array:
+    """Ramer-Douglas-Peucker on flat x, y coordinates.
+
+    Keeps the ends, then keeps the point furthest from the segment between them as
+    long as it is further than tolerance, and repeats on both halves.
+    Uses its own stack, a long path can't hit the recursion limit.
+    """
+    count = len(coords) // 2
+    if count < 3 or tolerance <= 0:
+        return coords
+    keep = bytearray(count)
+    keep[0] = keep[-1] = 1
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        x_1, y_1, x_2, y_2 = coords[2 * first], coords[2 * first + 1], coords[2 * last], coords[2 * last + 1]
+        d_x, d_y = x_2 - x_1, y_2 - y_1
+        length = d_x * d_x + d_y * d_y
+        worst, worst_dist = 0, tolerance
+        for idx in range(first + 1, last):
+            p_x, p_y = coords[2 * idx] - x_1, coords[2 * idx + 1] - y_1
+            along = min(max((p_x * d_x + p_y * d_y) / length, 0.0), 1.0) if length else 0.0
+            dist = math.hypot(p_x - along * d_x, p_y - along * d_y)
+            if dist > worst_dist:
+                worst, worst_dist = idx, dist
+        if worst:
+            keep[worst] = 1
+            stack.append((first, worst))
+            stack.append((worst, last))
+    return array("d", chain.from_iterable(coords[2 * idx : 2 * idx + 2] for idx in range(count) if keep[idx]))
+
+
+def read_file(filename: str) -> str:
+    """Reads the provided file in UTF-8"""
+    if Path(filename).is_file():
+        with open(filename, "r", encoding="utf-8") as f_handle:
+            return f_handle.read()
+    return ""
+
+
+def a_encloses_b(bbox_a: BBox, bbox_b: BBox) -> bool:
+    """Checks if the bounding box a, encloses bounding box b"""
+    return (
+        bbox_a.min_x <= bbox_b.min_x
+        and bbox_a.min_y <= bbox_b.min_y
+        and bbox_a.max_x >= bbox_b.max_x
+        and bbox_a.max_y >= bbox_b.max_y
+    )
+
+
+def bbox_area(bbox: BBox) -> float:
+    """Area of a bounding box"""
+    return (bbox.max_x - bbox.min_x) * (bbox.max_y - bbox.min_y)
+
+
+def nesting_rank(bbox: BBox, idx: int) -> tuple[float, float, int]:
+    """Sorts anything enclosing a box before it, unless the two are identical"""
+    return -bbox_area(bbox), -(bbox.max_x - bbox.min_x + bbox.max_y - bbox.min_y), idx
+
+
+def is_closed(part: Part, tolerance: float = CLOSED_TOLERANCE_MM) -> bool:
+    """Does the cut end back where it started"""
+    return len(part) > 2 and math.dist(part.start, part.end) <= tolerance
+
+
+def points_in_polygon(points, polygon, chunk: int = 1 << 20):
+    """Even-odd test of every (x, y) row of points against the closed polygon, as a bool array.
+
+    Every point against every edge at once, in chunks of points so the
+    points x edges arrays stay around chunk elements.
+    """
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
+    x_1, y_1 = polygon[:, 0], polygon[:, 1]
+    x_2, y_2 = np.roll(x_1, -1), np.roll(y_1, -1)
+    rise = np.where(y_2 == y_1, 1.0, y_2 - y_1)
+    inside = np.empty(len(points), dtype=bool)
+    step = max(1, chunk // max(len(polygon), 1))
+    for first in range(0, len(points), step):
+        x_p, y_p = points[first : first + step, 0:1], points[first : first + step, 1:2]
+        spans = (y_1 > y_p) != (y_2 > y_p)
+        crossing = x_1 + (y_p - y_1) * (x_2 - x_1) / rise
+        inside[first : first + step] = np.count_nonzero(spans & (x_p < crossing), axis=1) % 2 == 1
+    return inside
+
+
+def a_contains_b(part_a: Part, part_b: Part, tolerance: float = CLOSED_TOLERANCE_MM) -> bool:
+    """Checks if the cut a goes around cut b, by shape and not just bounding box.
+
+    a_encloses_b goes first, it throws out nearly everything for nothing. An open
+    a has no inside to go by, and an outline that starts from a lead-in or pierce
+    point counts as open, so for those the bounding box is the answer, the same as
+    without shapes. Otherwise every point of b has to be inside a, or within
+    tolerance of its edge, so parts touching the outline still count. b can be open or closed.
+    """
+    if not a_encloses_b(part_a.bbox, part_b.bbox):
+        return False
+    if not is_closed(part_a, tolerance):
+        return True
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
+    polygon = np.frombuffer(part_a.coords).reshape(-1, 2)
+    points = np.frombuffer(part_b.coords).reshape(-1, 2)
+    outside = points[~points_in_polygon(points, polygon)]
+    return not len(outside) or near_outline(outside, polygon, tolerance)
+
+
+def near_outline(points, polygon, tolerance: float, chunk: int = 1 << 20) -> bool:
+    """Are all the (x, y) rows of points within tolerance of an edge of polygon.
+
+    Chunked like points_in_polygon, and it stops at the first chunk with a point
+    too far out, a part that is really outside usually fails in the first one.
+    """
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
+    start, delta = polygon[:-1], np.diff(polygon, axis=0)
+    length = np.maximum(np.einsum("ij,ij->i", delta, delta), 1e-300)
+    step = max(1, chunk // max(len(start), 1))
+    for first in range(0, len(points), step):
+        offset = points[first : first + step, None, :] - start[None, :, :]
+        along = np.clip(np.einsum("kij,ij->ki", offset, delta) / length, 0.0, 1.0)
+        gaps = np.hypot(*np.moveaxis(offset - along[:, :, None] * delta[None, :, :], 2, 0))
+        if not np.all(gaps.min(axis=1) <= tolerance):
+            return False
+    return True
+
+
+def nest_parts(parts: list[Part], shapes: bool = False) -> list[Part]:
+    """Build the nesting tree of the parts, and give back the outer most ones.
+
+    Each part becomes a child of the smallest parts that enclose it, so children
+    only holds direct children, not every grand child under them.
+    That is one parent, unless bounding boxes overlap and two boxes that don't
+    enclose each other both enclose the part, then it is a child of both.
+    Bounding boxes are dropped into a uniform grid of about sqrt(n) x sqrt(n) cells,
+    anything enclosing a part has to cover the cell its center is in, so that one
+    cell is all that gets checked instead of every other part.
+    A part can only be the parent of parts ranked after it, biggest box first, then the
+    longest sides for boxes with no area, like a straight cut lying along a longer one.
+    Identical boxes enclose each other, so the earlier one wins.
+    With shapes, enclosing means a_contains_b, the actual outline and not the box.
+    Anything inside a shape is inside its box too, so the grid works the same.
+    """
+    if shapes:
+        encloses = a_contains_b
+    else:
+
+        def encloses(outer: Part, inner: Part) -> bool:
+            return a_encloses_b(outer.bbox, inner.bbox)
+
+    for part in parts:
+        part.used = False
+        part.children = []
+    if not parts:
+        return []
+
+    # Rank is the order parents have to come before children in, biggest first.
+    order = sorted(range(len(parts)), key=lambda idx: nesting_rank(parts[idx].bbox, idx))
+    rank = [0] * len(parts)
+    for pos, idx in enumerate(order):
+        rank[idx] = pos
+
+    cells = max(1, int(math.sqrt(len(parts))))
+    left = min(part.bbox.min_x for part in parts)
+    bottom = min(part.bbox.min_y for part in parts)
+    cell_w = (max(part.bbox.max_x for part in parts) - left) / cells or 1.0
+    cell_h = (max(part.bbox.max_y for part in parts) - bottom) / cells or 1.0
+
+    def cell(x_pos: float, y_pos: float) -> tuple[int, int]:
+        return min(int((x_pos - left) / cell_w), cells - 1), min(int((y_pos - bottom) / cell_h), cells - 1)
+
+    grid: dict[tuple[int, int], list[int]] = {}
+    for idx in order:
+        bbox = parts[idx].bbox
+        (col_1, row_1), (col_2, row_2) = cell(bbox.min_x, bbox.min_y), cell(bbox.max_x, bbox.max_y)
+        for col in range(col_1, col_2 + 1):
+            for row in range(row_1, row_2 + 1):
+                grid.setdefault((col, row), []).append(idx)
+
+    roots = []
+    for idx, part in enumerate(parts):
+        center = cell((part.bbox.min_x + part.bbox.max_x) / 2, (part.bbox.min_y + part.bbox.max_y) / 2)
+        # Cells are filled biggest first, so walking backwards meets the smallest enclosing parts first,
+        # anything enclosing one of those is a grand parent and gets skipped.
+        parents: list[Part] = []
+        for other in reversed(grid[center]):
+            outer = parts[other]
+            if (
+                rank[other] < rank[idx]
+                and encloses(outer, part)
+                and not any(encloses(outer, parent) for parent in parents)
+            ):
+                parents.append(outer)
+        for parent in parents:
+            parent.children.append(part)
+            parent.used = part.used = True
+        if not parents:
+            roots.append(part)
+    return roots
+
+
+def parts_by_row(parts: list[Part]):
+    """Takes an iterable of parts, and sorts them into psudo rows
+
+    A row is the top most part left, and every part reaching above its bottom.
+    Sorted by the top that is always a run of the sorted list, so the end of each
+    row is a binary search, not a scan of everything left.
+    """
+    rows = []
+    reverse_it = False
+    new_parts = sorted(parts, key=lambda x: x.bbox.max_y, reverse=True)
+    tops = [-x.bbox.max_y for x in new_parts]
+    start = 0
+    while start < len(new_parts):
+        end = max(start + 1, bisect_left(tops, -new_parts[start].bbox.min_y, lo=start + 1))
+        rows.append(sorted(new_parts[start:end], key=lambda x: x.bbox.min_x, reverse=reverse_it))
+        reverse_it = not reverse_it
+        start = end
+
+    return rows
+
+
+def gcode_buffer(source) -> bytes:
+    """The whole of a string, file object, bytes or mmap as something bytes like to parse.
+
+    An mmap is used as is, so it has to stay open as long as the parts do.
+    CRLF files are turned into plain newlines, that one costs a copy.
+    """
+    if hasattr(source, "read") and not isinstance(source, mmap.mmap):
+        source = source.read()
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    elif isinstance(source, (bytearray, memoryview)):
+        source = bytes(source)
+    if source.find(b"\r\n", 0, 4096) >= 0:
+        source = source[:].replace(b"\r\n", b"\n")
+    return source
+
+
+def parse_gcode(gcode) -> tuple[str, str, list[Part]]:
+    """Take WAZER g-code and break it into sections
+
+    See the code in https://wam.wazer.com/wazercam/wazercam.min.js
+
+    This is a single pass over the file, so it takes a string, an open file
+    or an mmap. Header runs up to the M1412 line, the footer is everything from
+    the M1413 line on, and a block is a G0 move up to the G4/M5/G4 ending.
+    The searching is all bytes.find, and the parts only keep where their block
+    is in the buffer, none of the g-code gets copied.
+    """
+    source = gcode_buffer(gcode)
+    header_at = source.find(HEADER_END)
+    header_end = source.find(b"\n", header_at + 1) + 1 if header_at >= 0 else 0
+    footer_start = source.find(FOOTER_START, header_end - 1) + 1 if header_end else 0
+    if not footer_start:
+        return None, None, None
+
+    parts: list[Part] = []
+    pos = header_end
+    while match := BLOCK_START_LINE.search(source, pos, footer_start):
+        # Searching from the end of the G0 line, so there is at least one line before the ending.
+        end = source.find(BLOCK_END, match.end(), footer_start)
+        if end < 0:
+            break
+        pos = end + len(BLOCK_END)
+        parts.append(make_part(source, match.start(), pos))
+
+    if not parts:
+        return None, None, None
+    return source[:header_end].decode("utf-8"), source[footer_start:].decode("utf-8"), parts
+
+
+def parse_gcode_file(filename) -> tuple[str, str, list[Part]]:
+    """Parse a file, read in one go so the parts can share its bytes
+
+    Not an mmap, the parts outlive this and an open mapping stops Windows
+    renaming or deleting the file.
+    """
+    path = Path(filename)
+    if not path.is_file() or not path.stat().st_size:
+        return None, None, None
+    return parse_gcode(path.read_bytes())
+
+
+def make_part(source: bytes, start: int, end: int) -> Part:
+    """Build a part from the block between start and end in source"""
+    return Part(block_coords(source, start, end), source, (start, end))
+
+
+def reorder_parts(parts: list[Part], shapes: bool = False) -> list[Part]:
+    """Reorder the parts in a 'sane' fasion.
+
+    Currently it simply takes each section of gcode (G0 bookends)
+    Determines if there are any bounding boxes that wholely fall
+    inside the part it's looking at, and if there is... It considers
+    it a child part (see nest_parts).
+    Once it knows parts that have parts inside them, it orders the outer most parts by some psudo rows
+    then children parts are drawn first, then the part they are contained in.
+    I have confirmed this works with fairly complex test drawings.
+    With shapes, nesting goes by the outline of closed cuts instead of bounding
+    boxes, so nothing sitting in the notch of an L counts as inside it.
+    """
+
+    rows = parts_by_row(nest_parts(parts, shapes))
+    new_order = []
+    done: set[int] = set()
+    for row in rows:
+        for part in row:
+            new_order.extend(children_first(part, done))
+    return new_order
+
+
+def children_first(part: Part, done: set[int]) -> list[Part]:
+    """Reorder parts children first into a list
+
+    done holds the id() of parts already placed, a part with two parents only goes in once.
+    Walks its own stack instead of recursing, deep nesting can't hit the recursion limit.
+    """
+    if id(part) in done:
+        return []
+    order = []
+    stack = [(part, iter(part.children or ()))]
+    while stack:
+        node, children = stack[-1]
+        for child in children:
+            if id(child) not in done:
+                stack.append((child, iter(child.children or ())))
+                break
+        else:
+            stack.pop()
+            done.add(id(node))
+            order.append(node)
+    return order
+
+
+# An edit of a CutOrder: the first position that changed, the position each cut from
+# there on came from before the edit, and the positions of the cuts it moved.
+OrderChange = namedtuple("OrderChange", "start, sources, selected")
+
+
+class CutOrder:
+    """The order the cuts go in, as an array of positions into the parts the way they were parsed.
+
+    Every edit keeps just enough to undo it. A move keeps where the cuts were taken from
+    and where they went, a step keeps the swaps it made, and only a whole new order,
+    like from Rearrange or Optimize, keeps both arrays. The parts themselves are never copied.
+    Moving k cuts is O(k) Python work, plus slicing the array, which is a memmove.
+    """
+
+    def __init__(self, parts: list[Part], history: int = 1000):
+        self.parts = list(parts)
+        self.order = array("l", range(len(self.parts)))
+        self.undos: deque = deque(maxlen=history)
+        self.redos: list = []
+        self.where: Optional[dict[Part, int]] = None
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def current(self) -> list[Part]:
+        """The parts in their current order"""
+        parts = self.parts
+        return [parts[idx] for idx in self.order]
+
+    def move(self, positions: Iterable[int], target: int) -> Optional[OrderChange]:
+        """Take the cuts at positions out, and put them back in the same order with the first at target"""
+        positions = tuple(sorted(set(positions)))
+        if not positions:
+            return None
+        target = max(0, min(target, len(self.order) - len(positions)))
+        return self.record(("move", positions, target))
+
+    def to_front(self, positions: Iterable[int]) -> Optional[OrderChange]:
+        """The cuts at positions go first"""
+        return self.move(positions, 0)
+
+    def to_back(self, positions: Iterable[int]) -> Optional[OrderChange]:
+        """The cuts at positions go last"""
+        return self.move(positions, len(self.order))
+
+    def step(self, positions: Iterable[int], offset: int) -> Optional[OrderChange]:
+        """Each cut at positions swaps with its neighbour, offset -1 is up a place and 1 down.
+
+        A cut already at the end, or stuck behind one that is, stays put.
+        """
+        ahead = sorted(set(positions), reverse=offset > 0)
+        stuck = set()
+        swaps = []
+        for idx in ahead:
+            if 0 <= idx + offset < len(self.order) and idx + offset not in stuck:
+                swaps.append((idx, idx + offset))
+            else:
+                stuck.add(idx)
+        if not swaps:
+            return None
+        behind = tuple(idx if idx in stuck else idx + offset for idx in ahead)
+        return self.record(("step", tuple(swaps), tuple(ahead), behind))
+
+    def replace(self, parts: list[Part]) -> Optional[OrderChange]:
+        """Take on parts as the new order, they have to be the same parts in any order"""
+        if self.where is None:
+            self.where = {part: idx for idx, part in enumerate(self.parts)}
+        return self.record(("set", self.order, array("l", (self.where[part] for part in parts))))
+
+    def undo(self) -> Optional[OrderChange]:
+        if not self.undos:
+            return None
+        delta = self.undos.pop()
+        self.redos.append(delta)
+        return self.apply(delta, forward=False)
+
+    def redo(self) -> Optional[OrderChange]:
+        if not self.redos:
+            return None
+        delta = self.redos.pop()
+        self.undos.append(delta)
+        return self.apply(delta, forward=True)
+
+    def record(self, delta: tuple) -> Optional[OrderChange]:
+        """Apply a new edit, and remember it if it changed anything"""
+        change = self.apply(delta, forward=True)
+        if change.sources == list(range(change.start, change.start + len(change.sources))):
+            return None
+        self.undos.append(delta)
+        self.redos.clear()
+        return change
+
+    def apply(self, delta: tuple, forward: bool) -> OrderChange:
+        order = self.order
+        match delta:
+            case ("move", positions, target):
+                count = len(positions)
+                start = min(positions[0], target)
+                end = max(positions[-1], target + count - 1) + 1
+                before = order[start:end]
+                if forward:
+                    moved = array("l", (order[idx] for idx in positions))
+                    rest = array("l")
+                    prev = 0
+                    for idx in positions:
+                        rest += order[prev:idx]
+                        prev = idx + 1
+                    rest += order[prev:]
+                    self.order = rest[:target] + moved + rest[target:]
+                    selected = range(target, target + count)
+                else:
+                    moved = order[target : target + count]
+                    rest = order[:target] + order[target + count :]
+                    undone = array("l")
+                    prev = 0
+                    for placed, idx in enumerate(positions):
+                        undone += rest[prev : idx - placed]
+                        undone.append(moved[placed])
+                        prev = idx - placed
+                    undone += rest[prev:]
+                    self.order = undone
+                    selected = positions
+            case ("step", swaps, ahead, behind):
+                start = min(min(pair) for pair in swaps)
+                end = max(max(pair) for pair in swaps) + 1
+                before = order[start:end]
+                for idx_a, idx_b in swaps if forward else reversed(swaps):
+                    order[idx_a], order[idx_b] = order[idx_b], order[idx_a]
+                selected = behind if forward else ahead
+            case ("set", old, new):
+                start, end = 0, len(order)
+                before = order
+                self.order = array("l", new if forward else old)
+                selected = ()
+        came_from = dict(zip(before, range(start, end)))
+        return OrderChange(start, list(map(came_from.__getitem__, self.order[start:end])), selected)
+
+
+def rapid_distance(parts: list[Part], origin: tuple[float, float] = (0.0, 0.0)) -> float:
+    """Total G0 travel in mm, from the origin to the first block then from each block's end to the next start"""
+    total = 0.0
+    position = origin
+    for part in parts:
+        total += math.dist(position, part.start)
+        position = part.end
+    return total
+
+
+def toolpath_stats(
+    parts: list[Part], origin: tuple[float, float] = (0.0, 0.0), rapid_feed: float = RAPID_MM_PER_MIN
+) -> ToolpathStats:
+    """Cut length, G0 travel, pierces and an estimated run time, for the parts in this order.
+
+    Every point of every part goes into one array behind the origin, so the step
+    into each part's first point is its G0 and every other step is a G1.
+    Feeds are in mm/min and carried forward from the last F, like the controller
+    does, even across blocks. Each block is one pierce, its dwell is in its G4s.
+    """
+    # NumPy takes longer to import than the rest of this module put together, only pay for it here.
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
+    if not parts:
+        return ToolpathStats(0.0, 0.0, 0, 0.0, 0.0)
+    coords = [array("d", origin)] + [part.coords for part in parts]
+    counts = np.fromiter(map(len, coords[1:]), dtype=np.int64, count=len(parts)) // 2
+    points = np.frombuffer(b"".join(coords))
+    steps = np.hypot(*np.diff(points.reshape(-1, 2), axis=0).T)
+    firsts = np.cumsum(counts) - counts
+    rapid = np.zeros(len(steps), dtype=bool)
+    rapid[firsts] = True
+
+    motions = [part.motion() for part in parts]
+    changes = [(first + point, value) for first, (feeds, _) in zip(firsts.tolist(), motions) for point, value in feeds]
+    feed = np.full(len(steps), np.nan)
+    if changes:
+        at, values = zip(*changes)
+        feed[list(at)] = values
+    dwell = sum(seconds for _, seconds in motions)
+    known = ~np.isnan(feed)
+    cut_s = 0.0
+    if known.any():
+        # Anything before the first F cuts at the first F.
+        feed[0] = feed[np.argmax(known)]
+        known[0] = True
+        feed = feed[np.maximum.accumulate(np.where(known, np.arange(len(feed)), 0))]
+        cut_s = float(np.sum(steps[~rapid] / feed[~rapid])) * 60
+
+    rapid_mm = float(steps[rapid].sum())
+    seconds = cut_s + rapid_mm / rapid_feed * 60 + dwell
+    return ToolpathStats(float(steps[~rapid].sum()), rapid_mm, len(parts), dwell, seconds)
+
+
+def wazer_estimate(footer: str) -> Optional[int]:
+    """Seconds from the M1413 hh:mm:ss WAZER puts in the footer, it doesn't change when parts move"""
+    if match := ESTIMATE_REGEX.search(footer or ""):
+        return int(match[1]) * 3600 + int(match[2]) * 60 + int(match[3])
+    return None
+
+
+class PointGrid:
+    """Uniform grid of points for nearest point lookups, points can be added and removed."""
+
+    def __init__(self, bbox: BBox, count: int):
+        cells = max(1, int(math.sqrt(count)))
+        self.left, self.bottom = bbox.min_x, bbox.min_y
+        self.cell = max(bbox.max_x - bbox.min_x, bbox.max_y - bbox.min_y) / cells or 1.0
+        self.rings = cells + 1
+        self.cells: dict[tuple[int, int], dict[int, tuple[float, float]]] = {}
+
+    def key(self, point: tuple[float, float]) -> tuple[int, int]:
+        return int((point[0] - self.left) // self.cell), int((point[1] - self.bottom) // self.cell)
+
+    def add(self, idx: int, point: tuple[float, float]):
+        self.cells.setdefault(self.key(point), {})[idx] = point
+
+    def remove(self, idx: int, point: tuple[float, float]):
+        del self.cells[self.key(point)][idx]
+
+    def nearest(self, point: tuple[float, float], count: int = 1) -> list[int]:
+        """The count indexes closest to point, closest first.
+
+        Searches rings of cells outwards and stops once a ring can't hold anything closer.
+        A point well off the grid, like the origin with every part in the far corner,
+        would walk rings of empty cells all the way there, so that gets every point checked instead.
+        """
+        col, row = self.key(point)
+        if not (-1 <= col <= self.rings and -1 <= row <= self.rings):
+            everything = (
+                (math.dist(point, other), idx) for points in self.cells.values() for idx, other in points.items()
+            )
+            return [idx for _, idx in heapq.nsmallest(count, everything)]
+        found: list[tuple[float, int]] = []
+        for ring in range(self.rings + max(abs(col), abs(row))):
+            for cell_col in range(col - ring, col + ring + 1):
+                step = 1 if abs(cell_col - col) == ring else 2 * ring or 1
+                for cell_row in range(row - ring, row + ring + 1, step):
+                    for idx, other in self.cells.get((cell_col, cell_row), {}).items():
+                        found.append((math.dist(point, other), idx))
+            if len(found) >= count:
+                found.sort()
+                if found[count - 1][0] <= ring * self.cell:
+                    break
+        found.sort()
+        return [idx for _, idx in found[:count]]
+
+
+def segment_distance(point: tuple[float, float], start: tuple[float, float], end: tuple[float, float]) -> float:
+    """Distance from a point to the line segment start to end"""
+    d_x, d_y = end[0] - start[0], end[1] - start[1]
+    p_x, p_y = point[0] - start[0], point[1] - start[1]
+    length = d_x * d_x + d_y * d_y
+    along = min(max((p_x * d_x + p_y * d_y) / length, 0.0), 1.0) if length else 0.0
+    return math.hypot(p_x - along * d_x, p_y - along * d_y)
+
+
+class SegmentIndex:
+    """Uniform grid over the bounding boxes of polyline segments, for finding what got clicked.
+
+    Each segment goes in every cell its box touches, a lookup only measures
+    the segments in the cells within tolerance of the point.
+    """
+
+    def __init__(self, paths: Iterable[tuple[Hashable, Sequence[tuple[float, float]]]]):
+        self.segments: list[tuple[Hashable, tuple[float, float], tuple[float, float]]] = []
+        for key, points in paths:
+            if len(points) == 1:
+                self.segments.append((key, points[0], points[0]))
+            self.segments.extend((key, start, end) for start, end in zip(points, points[1:]))
+        self.cells: dict[tuple[int, int], list[int]] = {}
+        if not self.segments:
+            self.cell = 1.0
+            return
+        x_points = [x for _, start, end in self.segments for x in (start[0], end[0])]
+        y_points = [y for _, start, end in self.segments for y in (start[1], end[1])]
+        extent = max(max(x_points) - min(x_points), max(y_points) - min(y_points))
+        self.cell = extent / max(1, int(math.sqrt(len(self.segments)))) or 1.0
+        for idx, (_, start, end) in enumerate(self.segments):
+            (min_x, max_x), (min_y, max_y) = sorted((start[0], end[0])), sorted((start[1], end[1]))
+            for key in self.keys(min_x, min_y, max_x, max_y):
+                self.cells.setdefault(key, []).append(idx)
+
+    def keys(self, min_x: float, min_y: float, max_x: float, max_y: float) -> Iterator[tuple[int, int]]:
+        for col in range(int(min_x // self.cell), int(max_x // self.cell) + 1):
+            for row in range(int(min_y // self.cell), int(max_y // self.cell) + 1):
+                yield col, row
+
+    def nearest(self, point: tuple[float, float], tolerance: float) -> Optional[Hashable]:
+        """Key of the path passing closest to point, None if nothing is within tolerance"""
+        best, best_dist = None, tolerance
+        x_pos, y_pos = point
+        for key in self.keys(x_pos - tolerance, y_pos - tolerance, x_pos + tolerance, y_pos + tolerance):
+            for idx in self.cells.get(key, ()):
+                path, start, end = self.segments[idx]
+                if (dist := segment_distance(point, start, end)) <= best_dist:
+                    best, best_dist = path, dist
+        return best
+
+
+def optimize_travel(
+    parts: list[Part], time_budget: float = 0.5, origin: tuple[float, float] = (0.0, 0.0), shapes: bool = False
+):
+    """Reorder the parts to cut down on G0 travel, still cutting children before whatever encloses them.
+
+    Starts with nearest neighbour, always going to the closest start point of the parts
+    that have all their children cut already. Then Or-opt, moving runs of 1 to 3 blocks
+    to sit behind one of the blocks ending near them, as long as that saves travel and
+    doesn't put a part before one of its children. Or-opt stops when it runs out of
+    moves or time_budget seconds.
+    2-opt doesn't fit, reversing a run of blocks would need the blocks cut backwards.
+    shapes is passed on to nest_parts.
+    """
+    if not parts:
+        return []
+    nest_parts(parts, shapes)
+    index = {id(part): idx for idx, part in enumerate(parts)}
+    children = [[index[id(child)] for child in part.children] for part in parts]
+    parents: list[list[int]] = [[] for _ in parts]
+    for idx, kids in enumerate(children):
+        for kid in kids:
+            parents[kid].append(idx)
+    starts = [part.start for part in parts]
+    ends = [part.end for part in parts]
+    deadline = time.perf_counter() + time_budget
+    sheet = BBox(
+        min(min(x for x, _ in starts), min(x for x, _ in ends)),
+        min(min(y for _, y in starts), min(y for _, y in ends)),
+        max(max(x for x, _ in starts), max(x for x, _ in ends)),
+        max(max(y for _, y in starts), max(y for _, y in ends)),
+    )
+
+    # Nearest neighbour, only parts with no children left to cut are in the grid.
+    waiting = [len(kids) for kids in children]
+    ready = PointGrid(sheet, len(parts))
+    for idx, count in enumerate(waiting):
+        if not count:
+            ready.add(idx, starts[idx])
+    order = []
+    position = origin
+    for _ in parts:
+        idx = ready.nearest(position)[0]
+        ready.remove(idx, starts[idx])
+        order.append(idx)
+        position = ends[idx]
+        for parent in parents[idx]:
+            waiting[parent] -= 1
+            if not waiting[parent]:
+                ready.add(parent, starts[parent])
+
+    # Or-opt, candidates for what a run goes behind are the blocks ending closest to its start.
+    by_end = PointGrid(sheet, len(parts))
+    for idx, point in enumerate(ends):
+        by_end.add(idx, point)
+    near = [by_end.nearest(point, 8) for point in starts]
+    pos = [0] * len(parts)
+    for place, idx in enumerate(order):
+        pos[idx] = place
+
+    def end_at(place: int) -> tuple[float, float]:
+        return origin if place < 0 else ends[order[place]]
+
+    def travel(end: tuple[float, float], place: int) -> float:
+        return math.dist(end, starts[order[place]]) if place < len(order) else 0.0
+
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for length in (1, 2, 3):
+            first = 0
+            while first + length <= len(order) and time.perf_counter() < deadline:
+                last = first + length - 1
+                run = order[first : last + 1]
+                run_start, run_end = starts[run[0]], ends[run[-1]]
+                before = end_at(first - 1)
+                removed = travel(before, last + 1) - math.dist(before, run_start) - travel(run_end, last + 1)
+                best, best_after = -1e-9, None
+                for after in [pos[idx] for idx in near[run[0]]] + [-1]:
+                    if first - 1 <= after <= last:
+                        continue
+                    if after < first and any(after < pos[kid] < first for idx in run for kid in children[idx]):
+                        continue
+                    if after > last and any(last < pos[par] <= after for idx in run for par in parents[idx]):
+                        continue
+                    end = end_at(after)
+                    added = math.dist(end, run_start) + travel(run_end, after + 1) - travel(end, after + 1)
+                    if removed + added < best:
+                        best, best_after = removed + added, after
+                if best_after is None:
+                    first += 1
+                    continue
+                if best_after < first:
+                    order[best_after + 1 : last + 1] = run + order[best_after + 1 : first]
+                    changed = range(best_after + 1, last + 1)
+                else:
+                    order[first : best_after + 1] = order[last + 1 : best_after + 1] + run
+                    changed = range(first, best_after + 1)
+                for place in changed:
+                    pos[order[place]] = place
+                improved = True
+                first += 1
+    return [parts[idx] for idx in order]
+
+
+def block_coords(source: bytes, start: int = 0, end: Optional[int] = None) -> array:
+    """Every X and Y between start and end in source, as one flat array"""
+    found = POINT_REGEX.findall(source, start, len(source) if end is None else end)
+    return array("d", map(float, chain.from_iterable(found)))
+
+
+def compact_block(block: bytes, tolerance: float, coords: Optional[Sequence[float]] = None) -> bytes:
+    """Drop the G1 moves that are within tolerance of a straight line, merging them into the next move.
+
+    Only a G1 with nothing after its X and Y can go, and only when the line after
+    it is one of those too. So a line with an F stays, and so does the move before
+    it, every stretch still cuts at the feed it did. G0, G4 and M lines are never
+    touched, and nothing merges across them.
+    coords are the block's points as parsed, Part.coords, so the numbers don't get
+    read again. Without them, or if they don't line up with the lines, they get found.
+    Every point dropped narrows the directions the head can leave the last kept point
+    in and still pass within tolerance of it, so each line is checked once, however
+    long the straight run. That is a little stricter than measuring every dropped
+    point against every new segment, it never goes over the tolerance.
+    """
+    lines = block.split(b"\n")
+    has_point = [b"X" in line for line in lines]
+    if coords is None or 2 * sum(has_point) != len(coords):
+        coords, has_point = array("d"), []
+        for line in lines:
+            match = POINT_REGEX.search(line)
+            has_point.append(match is not None)
+            if match:
+                coords.extend((float(match[1]), float(match[2])))
+    kept = []
+    anchor = None  # Where the last line kept leaves the head.
+    reach = 0.0  # The furthest point dropped since the anchor.
+    window = None  # Directions from the anchor, as (base, low, high), the next end has to be in.
+    pending = None  # A bare G1, kept or dropped once the next line is seen.
+    at = 0
+    for line, point_line in zip(lines, has_point):
+        if point_line:
+            x_pos, y_pos = coords[at], coords[at + 1]
+            at += 2
+        bare = point_line and line.startswith(b"G1 X") and line.rstrip().count(b" ") == 2
+        if pending:
+            skipped, skip_x, skip_y = pending
+            step = math.hypot(skip_x - anchor[0], skip_y - anchor[1])
+            narrowed = narrow(window, anchor, skip_x, skip_y, tolerance) if bare else None
+            if (
+                narrowed is not None
+                and math.hypot(x_pos - anchor[0], y_pos - anchor[1]) >= max(reach, step)
+                and within(narrowed, anchor, x_pos, y_pos)
+            ):
+                window, reach = narrowed, max(reach, step)
+            else:
+                kept.append(skipped)
+                anchor, reach, window = (skip_x, skip_y), 0.0, None
+            pending = None
+        if bare and anchor is not None:
+            pending = (line, x_pos, y_pos)
+            continue
+        kept.append(line)
+        if point_line:
+            anchor, reach, window = (x_pos, y_pos), 0.0, None
+    if pending:
+        kept.append(pending[0])
+    return b"\n".join(kept)
+
+
+def narrow(window, anchor: tuple[float, float], x_pos: float, y_pos: float, tolerance: float):
+    """window cut down to the directions from anchor that pass within tolerance of x_pos, y_pos.
+
+    None when nothing is left. A point within tolerance of the anchor doesn't narrow
+    it, the anchor itself is on the segment.
+    """
+    distance = math.hypot(x_pos - anchor[0], y_pos - anchor[1])
+    if distance <= tolerance:
+        return window or (0.0, -math.pi, math.pi)
+    angle = math.atan2(y_pos - anchor[1], x_pos - anchor[0])
+    half = math.asin(tolerance / distance)
+    if window is None or window[1] <= -math.pi:
+        return angle, -half, half
+    base, low, high = window
+    offset = (angle - base + math.pi) % math.tau - math.pi
+    low, high = max(low, offset - half), min(high, offset + half)
+    return (base, low, high) if low <= high else None
+
+
+def within(window, anchor: tuple[float, float], x_pos: float, y_pos: float) -> bool:
+    """Is x_pos, y_pos in a direction from anchor that window allows"""
+    base, low, high = window
+    offset = (math.atan2(y_pos - anchor[1], x_pos - anchor[0]) - base + math.pi) % math.tau - math.pi
+    return low <= offset <= high
+
+
+def write_file(old_filename: Path, header: str, footer: str, parts: list[Part], tolerance: float = 0.0) -> Compaction:
+    """Write the output file in the same folder as the input, adding a t_
+
+    The blocks go out as slices of the bytes they were parsed from, nothing
+    gets joined or decoded on the way.
+    With a tolerance, straight runs of G1 moves get merged on the way out, see
+    compact_block, and what that took out of the file is given back.
+    """
+    path = Path(old_filename)
+    new_filename = path.parents[0] / f"t_{path.name}"
+    lines = saved = 0
+    with open(new_filename, mode="wb") as file:
+        file.write(header.encode("utf-8"))
+        if tolerance > 0:
+            for part in parts:
+                block = bytes(part.data)
+                compacted = compact_block(block, tolerance, part.coords)
+                lines += block.count(b"\n") - compacted.count(b"\n")
+                saved += len(block) - len(compacted)
+                file.write(compacted)
+        else:
+            file.writelines(part.data for part in parts)
+        file.write(footer.encode("utf-8"))
+    return Compaction(lines, saved)
+
+
+def scan_file(filename, chunk_size: int = 1 << 20) -> Iterator[tuple[str, bytes]]:
+    """Stream a WAZER file as ("header", bytes), ("block", bytes) for every block, then ("footer", bytes) pieces.
+
+    Finds the same header, blocks and footer parse_gcode does, reading chunk_size
+    at a time and only keeping what hasn't been handed out yet, so memory is a
+    chunk or the biggest block, whichever is more. Nothing comes out for a file
+    without a header. CRLF comes out as plain newlines, the way parse_gcode
+    reads it and write_file writes it.
+    """
+    with open(filename, "rb") as file:
+        buffer = b""
+        eof = False
+
+        def fill():
+            nonlocal buffer, eof
+            data = file.read(chunk_size)
+            if data.endswith(b"\r"):
+                data += file.read(1)
+            eof = not data
+            buffer += data.replace(b"\r\n", b"\n")
+
+        while (header_at := buffer.find(HEADER_END)) < 0 or buffer.find(b"\n", header_at + 1) < 0:
+            if eof:
+                return
+            fill()
+        header_end = buffer.find(b"\n", header_at + 1) + 1
+        yield "header", buffer[:header_end]
+        # Keeping the newline in front, the markers all start with one.
+        buffer, pos = buffer[header_end - 1 :], 1
+        # Only looked for when the buffer changes, looking per block would go over the buffer per block.
+        footer_at = buffer.find(FOOTER_START)
+
+        while True:
+            limit = footer_at + 1 if footer_at >= 0 else len(buffer)
+            match = BLOCK_START_LINE.search(buffer, pos, limit)
+            end = buffer.find(BLOCK_END, match.end(), limit) if match else -1
+            if end >= 0:
+                pos = end + len(BLOCK_END)
+                yield "block", buffer[match.start() : pos]
+            elif footer_at >= 0:
+                yield "footer", buffer[footer_at + 1 :]
+                while data := file.read(chunk_size):
+                    if data.endswith(b"\r"):
+                        data += file.read(1)
+                    yield "footer", data.replace(b"\r\n", b"\n")
+                return
+            elif eof:
+                return
+            else:
+                # Keep the block that hasn't ended yet, or the last line in case it's the start of one.
+                keep = match.start() - 1 if match else buffer.rfind(b"\n")
+                buffer, pos = buffer[keep:], 1
+                fill()
+                footer_at = buffer.find(FOOTER_START)
+
+
+def file_digests(filename, tolerance: float = 0.0) -> tuple[bytes, bytes, dict[bytes, list[int]]]:
+    """Hashes of the header and footer, and the block numbers of every distinct block hash.
+
+    With a tolerance the blocks are hashed as compact_block would write them,
+    to check a compacted output against its original. Each block's points are
+    found in one go, the same as the parser does, so compacting stays cheap.
+    """
+    header = hashlib.blake2b(digest_size=16)
+    footer = hashlib.blake2b(digest_size=16)
+    blocks: dict[bytes, list[int]] = {}
+    count = 0
+    for kind, data in scan_file(filename):
+        if kind == "block":
+            count += 1
+            block = compact_block(data, tolerance, block_coords(data)) if tolerance > 0 else data
+            blocks.setdefault(hashlib.blake2b(block, digest_size=16).digest(), []).append(count)
+        elif kind == "header":
+            header.update(data)
+        else:
+            footer.update(data)
+    return header.digest(), footer.digest(), blocks
+
+
+def verify_output(original, output=None, tolerance: float = 0.0) -> Verification:
+    """Check a t_ file has exactly the blocks, header and footer of its original, in whatever order.
+
+    output defaults to the t_ file write_file makes next to the original. Only the
+    hashes of the blocks are kept, never the files. Pass the tolerance the file
+    was written with if it was compacted. Then the original blocks get compacted
+    again and compared, which only proves the output is what compact_block makes
+    of them, compact_block agreeing with itself. Whether the dropped lines were
+    really within tolerance, or only bare G1s went, is down to compact_block.
+    """
+    path = Path(original)
+    output = Path(output) if output else path.parents[0] / f"t_{path.name}"
+    header, footer, before = file_digests(path, tolerance)
+    header_out, footer_out, after = file_digests(output)
+    missing, duplicated, altered = [], [], []
+    for digest, numbers in before.items():
+        missing.extend(numbers[len(after.get(digest, ())) :])
+    for digest, numbers in after.items():
+        if digest not in before:
+            altered.extend(numbers)
+        else:
+            duplicated.extend(numbers[len(before[digest]) :])
+    return Verification(
+        header == header_out,
+        footer == footer_out,
+        sum(map(len, after.values())),
+        sorted(missing),
+        sorted(duplicated),
+        sorted(altered),
+    )
@@ -6,194 +6,386 @@ This code was hacked together after a few days and may contain errors.
 I created this because after 8 months of use, I have run across many cuts
 that the default cut order limits the machines capabilities.
 
-It has really three main use cases.
+It has really four main use cases.
     1)  Preview the cut order VERY quickly and simply with a graphical interface. (SAFE)
     2)  Manually select a cut, and move it up or down in the list of cuts. (PROBABLY SAFE)
+        Or move a whole selection to the front, the back or any position, with undo and redo.
     3)  Recursivly order cuts with the enclosing cut always last. (LEAST SAFE)
+        Enclosing goes by bounding box, or by the outline of closed cuts with "Nest by shape" ticked.
+    4)  Order cuts for the least rapid travel, still with the enclosing cut last. (LEAST SAFE)
     ** Always check the file out on another utiliy, no guarentees!
 
+PySimpleGUI is only imported once the window is made, the cache and loader in
+here can be used from scripts without paying for Tk.
 """
 
+from __future__ import annotations
+
+import argparse
+import atexit
 import glob
 import os
-import re
 import shutil
+import sqlite3
 import sys
-from collections import namedtuple
-from dataclasses import dataclass, field
+import threading
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing
+from functools import partial
+from itertools import chain
 from pathlib import Path
 from random import choice
-
-import PySimpleGUI as sg
-
-# GCode constants for WAM gcode files
-# These constants were all aquired from https://wam.wazer.com/wazercam/wazercam.min.js
-# WAZER can change them when ever they want, so there be dragons.
-HEADER_REGEX = "(.*\n)+?M1412 .*\n"
-BLOCK_START_REGEX = "G0 X-?(\\d+(?:\\.\\d+)?) Y-?(\\d+(?:.\\d+)?)\n"
-BLOCK_MIDDLE_REGEX = "(.*\n)+?"
-BLOCK_END_REGEX = "G4 S1.\nM5\nG4 S1.\n"
-FOOTER_REGEX = "M1413 .*(.*\n)+"
-CUT_WIDTH_MM = 457
-CUT_HEIGHT_MM = 304
-
-BBox = namedtuple("BBox", "min_x, min_y, max_x, max_y")
-
-
-@dataclass
-class Part:
-    """Minimum data required to easily deal with g-code sections."""
-
-    points: tuple[float] = field(repr=False)
-    g_code: str = field(repr=False)
-    bbox: BBox
-    used: bool = False
-    children: "Part" = None
-
-    def __hash__(self):
-        return hash(self.g_code)
-
-
-def read_file(filename: str) -> str:
-    """Reads the provided file in UTF-8"""
-    if Path(filename).is_file():
-        with open(filename, "r", encoding="utf-8") as f_handle:
-            return f_handle.read()
-    return ""
-
-
-def a_encloses_b(bbox_a: BBox, bbox_b: BBox) -> bool:
-    """Checks if the bounding box a, encloses bounding box b"""
-    return (
-        bbox_a.min_x <= bbox_b.min_x
-        and bbox_a.min_y <= bbox_b.min_y
-        and bbox_a.max_x >= bbox_b.max_x
-        and bbox_a.max_y >= bbox_b.max_y
-    )
-
-
-def parts_by_row(parts: list[Part]):
-    """Takes an iterable of parts, and sorts them into psudo rows"""
-    rows = []
-    reverse_it = False
-    new_parts = sorted(parts, key=lambda x: x.bbox.max_y, reverse=True)
-    while new_parts:
-        rows.append(
-            sorted(
-                [x for x in new_parts if new_parts[0].bbox.min_y < x.bbox.max_y or x == new_parts[0]],
-                key=lambda x: x.bbox.min_x,
-                reverse=reverse_it,
-            )
-        )
-        reverse_it = not reverse_it
-        [new_parts.remove(x) for x in rows[-1]]
-
-    return rows
-
-
-def parse_gcode(gcode: str) -> tuple[str, str, list[Part]]:
-    """Take WAZER g-code and break it into sections
-
-    See the code in https://wam.wazer.com/wazercam/wazercam.min.js
+from typing import TYPE_CHECKING, Optional
+
+import wam_core
+from wam_core import (
+    COMPACT_TOLERANCE_MM,
+    CUT_HEIGHT_MM,
+    CUT_WIDTH_MM,
+    CutOrder,
+    OrderChange,
+    Part,
+    SegmentIndex,
+    gcode_buffer,
+    optimize_travel,
+    parse_gcode_file,
+    rapid_distance,
+    reorder_parts,
+    toolpath_stats,
+    verify_output,
+    wazer_estimate,
+    write_file,
+)
+from wam_catalog import FolderCatalog
+from wam_profile import Profiler
+
+if TYPE_CHECKING:
+    import PySimpleGUI as sg
+
+
+class ParseCache:
+    """LRU cache of parsed files, keyed on path, size and mtime so an edited file is parsed again.
+
+    Keeps up to max_bytes of g-code and coordinates in memory. With on_disk, off
+    unless asked for, it also keeps a small SQLite file in each folder holding where
+    every file's header, blocks and footer are and the block coordinates, compressed,
+    so reopening the tool on a folder skips the parse too. The g-code itself is read
+    from the file again, that is quick, finding the blocks and pulling the numbers
+    out is what takes the time. Rows for files that are gone get dropped whenever a
+    row is written. Folders that can't be written to just don't get one.
+    Safe to share between threads, FileLoader parses on workers.
     """
-    header = re.match(HEADER_REGEX, gcode)
-    footer = re.search(FOOTER_REGEX, gcode)
-    parts: list[Part] = []
-
-    # hacked this up three times I should probably deal with the x/y as pairs in the regex
-    # Meh...
-    regex = "(-?\\d+(?:\\.\\d+)?)"
-    for match in re.finditer(BLOCK_START_REGEX + BLOCK_MIDDLE_REGEX + BLOCK_END_REGEX, gcode):
-        x_points = [float(x) for x in re.findall("X" + regex, match.group(0))]
-        y_points = [float(y) for y in re.findall("Y" + regex, match.group(0))]
-        part = Part(
-            points=tuple((_x, _y) for _x, _y in zip(x_points, y_points)),
-            g_code=match.group(0),
-            bbox=BBox(min(x_points), min(y_points), max(x_points), max(y_points)),
+
+    DISK_NAME = ".wam_cache.sqlite"
+    DISK_VERSION = 3
+
+    def __init__(self, max_bytes: int = 256 * 2**20, on_disk: bool = False):
+        self.max_bytes = max_bytes
+        self.on_disk = on_disk
+        self.size = 0
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[tuple, tuple[str, str, list[Part], int]] = OrderedDict()
+
+    def parse(self, filename) -> tuple[str, str, list[Part]]:
+        """parse_gcode_file, unless this version of the file was parsed already"""
+        path = Path(filename).resolve()
+        try:
+            stat = path.stat()
+        except OSError:
+            return None, None, None
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                self.entries.move_to_end(key)
+        if not entry:
+            header, footer, parts = self.load(path, key) or self.save(path, key, *parse_gcode_file(path))
+            if parts is None:
+                return None, None, None
+            entry = self.remember(key, header, footer, parts)
+        header, footer, parts, _ = entry
+        # Whatever the GUI does with the list, that can't leak back in here.
+        return header, footer, list(parts)
+
+    def remember(self, key: tuple, header: str, footer: str, parts: list[Part]) -> tuple:
+        size = len(header) + len(footer) + sum(len(part.data) + 8 * len(part.coords) for part in parts)
+        entry = (header, footer, parts, size)
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries[key][-1]
+            self.entries[key] = entry
+            self.size += size
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                *_, evicted = self.entries.popitem(last=False)[1]
+                self.size -= evicted
+        return entry
+
+    def connect(self, path: Path) -> sqlite3.Connection:
+        database = sqlite3.connect(path.parent / self.DISK_NAME, timeout=1)
+        if database.execute("PRAGMA user_version").fetchone()[0] != self.DISK_VERSION:
+            # Rows in an older layout are no use, start the file over.
+            with database:
+                database.execute("DROP TABLE IF EXISTS files")
+            database.execute(f"PRAGMA user_version = {self.DISK_VERSION}")
+        database.execute(
+            "CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, size INTEGER, mtime INTEGER,"
+            " header_end INTEGER, footer_start INTEGER, spans BLOB, coords BLOB)"
         )
-        parts.append(part)
-    if not all((header, footer, parts)):
-        return None, None, None
-    return header.group(0), footer.group(0), parts
-
-
-def reorder_parts(parts: list[Part]) -> list[Part]:
-    """Reorder the parts in a 'sane' fasion.
-
-    Currently it simply takes each section of gcode (G0 bookends)
-    Determines if there are any bounding boxes that wholely fall
-    inside the part it's looking at, and if there is... It considers
-    it a child part.
-    Once it knows parts that have parts inside them, it orders them by some psudo rows
-    then children parts are drawn first, then the part they are contained in.
-    I have confirmed this works with fairly complex test drawings.
+        return database
+
+    def load(self, path: Path, key: tuple):
+        """The parsed file from the folder's cache file, if it is there and current"""
+        if not self.on_disk or not (path.parent / self.DISK_NAME).is_file():
+            return None
+        try:
+            with closing(self.connect(path)) as database:
+                row = database.execute(
+                    "SELECT header_end, footer_start, spans, coords FROM files"
+                    " WHERE name = ? AND size = ? AND mtime = ?",
+                    (path.name, key[1], key[2]),
+                ).fetchone()
+            if not row:
+                return None
+            header_end, footer_start, spans, coords = row
+            source = gcode_buffer(path.read_bytes())
+            spans, coords = array("q", zlib.decompress(spans)), array("d", zlib.decompress(coords))
+        except (sqlite3.Error, OSError, zlib.error):
+            return None
+        # spans is the block start, block end and coordinate count of each part, in the file as parsed.
+        parts = []
+        coords_at = 0
+        for start, end, coords_len in zip(spans[0::3], spans[1::3], spans[2::3]):
+            parts.append(Part(coords[coords_at : coords_at + coords_len], source, (start, end)))
+            coords_at += coords_len
+        return source[:header_end].decode("utf-8"), source[footer_start:].decode("utf-8"), parts
+
+    def save(self, path: Path, key: tuple, header: str, footer: str, parts: list[Part]):
+        """Write the parsed file to the folder's cache file, passes the parse straight back"""
+        if self.on_disk and parts:
+            spans = array("q", chain.from_iterable((*part.span, len(part.coords)) for part in parts))
+            coords = array("d", chain.from_iterable(part.coords for part in parts))
+            header_end = len(header.encode("utf-8"))
+            footer_start = len(parts[0].source) - len(footer.encode("utf-8"))
+            row = (path.name, key[1], key[2], header_end, footer_start)
+            row += (zlib.compress(spans.tobytes(), 1), zlib.compress(coords.tobytes(), 1))
+            try:
+                with closing(self.connect(path)) as database, database:
+                    database.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+                    gone = [
+                        (name,)
+                        for (name,) in database.execute("SELECT name FROM files")
+                        if not (path.parent / name).is_file()
+                    ]
+                    database.executemany("DELETE FROM files WHERE name = ?", gone)
+            except sqlite3.Error:
+                pass
+        return header, footer, parts
+
+
+class FileLoader:
+    """Parses files on worker threads, so a slow share never freezes the window.
+
+    Results come back to the window as an event of (path, (header, footer, parts)).
+    Only the latest load gets reported. Older ones are cancelled if they haven't
+    started yet, or dropped when they finish. The neighbours passed along are parsed
+    into the cache on the side, so arrowing through a folder finds them ready.
+    With a preview_tolerance the workers simplify the parts for drawing too.
+    Saving a copy runs on the same workers, see save.
     """
 
-    # I'm sure I could do this recursivly and more elegantly to deal with deep nesting
-    # That is a problem for later.
-    blocks = {}
-    for part in parts:
-        part.used = False
-        part.children = []
-    for part1 in parts:
-        for part2 in parts:
-            if part1 != part2 and a_encloses_b(part1.bbox, part2.bbox):
-                part1.children.append(part2)
-                part1.used = part2.used = True
-                blocks.setdefault(part1, []).append(part2)
-    for part in parts:
-        if not part.used:
-            blocks.setdefault(part, [])
-    sorted_blocks: dict[Part, list[Part]] = sorted(blocks, key=lambda x: x.bbox.max_y, reverse=True)
-    rows = parts_by_row(sorted_blocks)
-    new_order = []
-    for row in rows:
-        for part in row:
-            extend = recursive_reorder(part)
-            for item in extend:
-                if item not in new_order:
-                    new_order.append(item)
-    return new_order
-
-
-def recursive_reorder(part: Part):
-    """Reorder parts children first into a list"""
-    extension = []
-    for subpart in part.children:
-        extension.extend(recursive_reorder(subpart))
-    return extension + [part]
-
-
-def write_file(old_filename: Path, header: str, footer: str, parts: list[Part]):
-    """Write the output file in the same folder as the input, adding a t_"""
-    path = Path(old_filename)
-    new_filename = path.parents[0] / f"t_{path.name}"
-    with open(new_filename, mode="w", encoding="utf-8") as file:
-        print(header, end="", file=file)
-        for part in parts:
-            print(part.g_code, end="", file=file)
-        print(footer, end="", file=file)
-
-
-def limit(num: int, min_allowed: int, max_allowed: int) -> int:
-    """Set limits on a number"""
-    if num < min_allowed:
-        return min_allowed
-    elif num > max_allowed:
-        return max_allowed
-    else:
-        return num
+    def __init__(
+        self, window, cache: ParseCache, event: str = "-LOADED-", workers: int = 3, preview_tolerance: float = 0.0
+    ):
+        self.window = window
+        self.cache = cache
+        self.event = event
+        self.preview_tolerance = preview_tolerance
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="wam-load")
+        self.pending: dict[Path, Future] = {}
+        self.lock = threading.Lock()
+        self.generation = 0
+
+    def submit(self, path: Path) -> Future:
+        """Parse path into the cache, unless it is already on its way"""
+        with self.lock:
+            future = self.pending.get(path)
+            if future is None or future.cancelled():
+                future = self.pending[path] = self.pool.submit(self.parse, path)
+            else:
+                return future
+        future.add_done_callback(partial(self.forget, path))
+        return future
+
+    def parse(self, path: Path) -> tuple[str, str, list[Part]]:
+        header, footer, parts = self.cache.parse(path)
+        if self.preview_tolerance:
+            for part in parts or ():
+                part.preview(self.preview_tolerance)
+        return header, footer, parts
+
+    def forget(self, path: Path, future: Future):
+        with self.lock:
+            if self.pending.get(path) is future:
+                del self.pending[path]
+
+    def load(self, path: Path, neighbours: tuple[Path] = ()):
+        """Parse path and post it back to the window, and prefetch the neighbours"""
+        self.generation += 1
+        with self.lock:
+            stale = [future for other, future in self.pending.items() if other != path and other not in neighbours]
+        for future in stale:
+            future.cancel()
+        self.submit(path).add_done_callback(partial(self.report, self.generation, path))
+        for neighbour in neighbours:
+            self.submit(neighbour)
+
+    def report(self, generation: int, path: Path, future: Future):
+        if generation != self.generation or future.cancelled():
+            return
+        try:
+            parsed = future.result()
+        except (OSError, ValueError):
+            parsed = None, None, None
+        self.window.write_event_value(self.event, (path, parsed))
+
+    def save(self, original: Path, header: str, footer: str, parts: list[Part], tolerance: float = 0.0):
+        """Write and verify the t_ copy of original, then post it back as a -SAVED- event.
+
+        The event is (original, tolerance, (compaction, verification)), or the error
+        in place of the pair if the copy couldn't be written.
+        """
+        future = self.pool.submit(self.write, original, header, footer, list(parts), tolerance)
+        future.add_done_callback(partial(self.saved, original, tolerance))
+
+    @staticmethod
+    def write(original: Path, header: str, footer: str, parts: list[Part], tolerance: float):
+        compaction = write_file(original, header, footer, parts, tolerance)
+        return compaction, verify_output(original, tolerance=tolerance)
+
+    def saved(self, original: Path, tolerance: float, future: Future):
+        if future.cancelled():
+            return
+        try:
+            result = future.result()
+        except (OSError, ValueError) as err:
+            result = err
+        self.window.write_event_value("-SAVED-", (original, tolerance, result))
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def preview_tolerance(graph: sg.Graph) -> float:
+    """Half a pixel of the graph, in mm"""
+    return (graph.TopRight[0] - graph.BottomLeft[0]) / graph.CanvasSize[0] / 2
 
 
 def draw_parts(parts: list[Part], graph: sg.Graph, slider: sg.Slider, color="white smoke") -> dict[int, int]:
-    """Draws the parts, and gives back the part mapping"""
+    """Draws the parts, and gives back the part mapping
+
+    Parts are drawn simplified to half a pixel, the canvas can't show any more than that.
+    """
     graph.erase()
-    figures = {idx: graph.draw_lines(part.points, color=color) for idx, part in enumerate(parts)}
+    tolerance = preview_tolerance(graph)
+    figures = {idx: graph.draw_lines(part.preview(tolerance), color=color) for idx, part in enumerate(parts)}
     slider.update(range=(0, len(figures)))
     slider.update(value=0)
     return figures
 
 
+def still_in_order(sources: list[int]) -> set[int]:
+    """Offsets of the longest run of sources that are still in increasing order, not always next to each other"""
+    tails: list[int] = []
+    tail_at: list[int] = []
+    links = [-1] * len(sources)
+    for offset, source in enumerate(sources):
+        length = bisect_left(tails, source)
+        links[offset] = tail_at[length - 1] if length else -1
+        if length == len(tails):
+            tails.append(source)
+            tail_at.append(offset)
+        else:
+            tails[length] = source
+            tail_at[length] = offset
+    staying = set()
+    offset = tail_at[-1] if tail_at else -1
+    while offset >= 0:
+        staying.add(offset)
+        offset = links[offset]
+    return staying
+
+
+class BedCanvas:
+    """The parts drawn on the bed, and which of the figures are red right now.
+
+    Keeping track of the colours means selecting and scrubbing only itemconfig the
+    figures that actually change, and moving cuts just restacks the figures that
+    moved, instead of drawing the whole bed again.
+    Clicks are found with a SegmentIndex of what was drawn, not by asking Tk.
+    """
+
+    def __init__(self, graph: sg.Graph, color: str = "white smoke", selected_color: str = "red"):
+        self.graph = graph
+        self.color = color
+        self.selected_color = selected_color
+        self.figures: dict[int, int] = {}
+        self.indexes: dict[int, int] = {}
+        self.red: set[int] = set()
+        self.hits = SegmentIndex(())
+        # A click within a pixel and a half of a cut picks it.
+        self.hit_tolerance = preview_tolerance(graph) * 3
+
+    def draw(self, parts: list[Part], slider: sg.Slider) -> dict[int, int]:
+        """Draw everything from scratch, gives back the part mapping"""
+        self.figures = draw_parts(parts, self.graph, slider, self.color)
+        self.indexes = {figure: idx for idx, figure in self.figures.items()}
+        self.red = set()
+        tolerance = preview_tolerance(self.graph)
+        self.hits = SegmentIndex((self.figures[idx], part.preview(tolerance)) for idx, part in enumerate(parts))
+        return self.figures
+
+    def cut_at(self, point: tuple[float, float]) -> Optional[int]:
+        """Index of the cut closest to point, if one is close enough"""
+        figure = self.hits.nearest(point, self.hit_tolerance)
+        return None if figure is None else self.indexes[figure]
+
+    def select(self, indexes):
+        """Make exactly the cuts at these indexes red"""
+        wanted = {self.figures[idx] for idx in indexes}
+        for figure in wanted - self.red:
+            self.graph.tk_canvas.itemconfig(figure, fill=self.selected_color)
+        for figure in self.red - wanted:
+            self.graph.tk_canvas.itemconfig(figure, fill=self.color)
+        self.red = wanted
+
+    def reorder(self, change: OrderChange):
+        """Follow an edit of the cut order, keeping later cuts drawn on top like draw_parts would.
+
+        The cuts that are still in the same order amongst themselves stay where they
+        are in the stack, only the rest get raised, so moving k cuts is k tag_raise
+        calls however far they go.
+        """
+        start, sources = change.start, change.sources
+        before = [self.figures[idx] for idx in range(start, start + len(sources))]
+        staying = still_in_order(sources)
+        canvas = self.graph.tk_canvas
+        for offset, source in enumerate(sources):
+            idx = start + offset
+            figure = before[source - start]
+            self.figures[idx] = figure
+            self.indexes[figure] = idx
+            if offset in staying:
+                continue
+            if idx:
+                canvas.tag_raise(figure, self.figures[idx - 1])
+            else:
+                canvas.tag_lower(figure, before[0])
+
+
 def list_files(folder: str, search=""):
     """Just list gcode files in supplied folder"""
     if Path(folder).is_dir():
@@ -204,6 +396,7 @@ def list_files(folder: str, search=""):
 
 
 def rename_popup(text, data):
+    import PySimpleGUI as sg  # pylint: disable=import-outside-toplevel
 
     layout = [
         [sg.Text(f"Rename {text}")],
@@ -232,8 +425,29 @@ def rename_popup(text, data):
         return values["-new_name-"]
 
 
+def clock(seconds: float) -> str:
+    """hh:mm:ss like WAZER's M1413"""
+    seconds = round(seconds)
+    return f"{seconds // 3600:02}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+
+
+def metadata(header: str, footer: str, parts: list[Part]) -> str:
+    """The material lines from the header, and what the parts come to in their current order.
+
+    WAZER's own estimate is in the footer, it is for the order the file came in.
+    """
+    stats = toolpath_stats(parts)
+    wazer = wazer_estimate(footer)
+    lines = header.splitlines()[1:9]
+    lines.append(f"Cut {stats.cut_mm:.0f}mm, rapids {stats.rapid_mm:.0f}mm, {stats.pierces} pierces")
+    lines.append(f"Estimated {clock(stats.seconds)}" + (f" (WAZER said {clock(wazer)})" if wazer is not None else ""))
+    return "\n".join(lines)
+
+
 def create_window():
     "Create the window object/layout."
+    import PySimpleGUI as sg  # pylint: disable=import-outside-toplevel
+
     sg.theme(choice(sg.theme_list()))
 
     # Graph objects for drawings sorta like local globals, smells bad, but I'm in a hurry.
@@ -277,14 +491,28 @@ def create_window():
         [
             sg.Button("Re-Draw"),
             sg.Button("Rearrange"),
+            sg.Button("Optimize"),
             sg.Button("Save Copy"),
             sg.Button("Delete"),
             sg.Button("Rename"),
         ],
-        [sg.Button("Up"), sg.Button("Down")],
+        [
+            sg.Button("Up"),
+            sg.Button("Down"),
+            sg.Button("To Front"),
+            sg.Button("To Back"),
+            sg.Button("Move To"),
+            sg.Button("Undo"),
+            sg.Button("Redo"),
+        ],
+        [
+            sg.Checkbox("Nest by shape", key="-SHAPES-"),
+            sg.Checkbox("Compact straight runs on save", key="-COMPACT-"),
+            sg.Checkbox("Cache parses on disk", key="-DISKCACHE-", enable_events=True),
+        ],
         [slider],
         [wazer_bed],
-        [sg.Text(text="\n\n\n\n\n\n\n\n", key="-METADATA-")],
+        [sg.Text(text="\n" * 10, key="-METADATA-")],
     ]
     files = sg.Listbox(
         values=list_files("."),
@@ -308,6 +536,31 @@ def main() -> int:
         int: Exit code for system.
     """
     # pylint: disable=no-member
+    import PySimpleGUI as sg  # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(description="G-code preview and re-order for WAM")
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        metavar="TRACE.json",
+        help="time events and core functions, summary on exit, and a Chrome trace if given a .json",
+    )
+    profiler = Profiler.configure(parser.parse_args().profile)
+    profiler.instrument(wam_core, "parse_gcode", "nest_parts", "parts_by_row")
+    profiler.instrument(
+        sys.modules[__name__],
+        "parse_gcode_file",
+        "reorder_parts",
+        "optimize_travel",
+        "toolpath_stats",
+        "write_file",
+        "draw_parts",
+    )
+    profiler.instrument(FolderCatalog, "search", "rescan")
+    profiler.instrument(ParseCache, "load", "save")
+    profiler.instrument(BedCanvas, "draw", "cut_at", "select", "reorder")
+    atexit.register(profiler.dump)
 
     window = create_window()
 
@@ -318,18 +571,29 @@ def main() -> int:
     files: sg.Listbox = window["-FILES-"]
     window.bind("<Down>", "-DOWN-")
     window.bind("<Up>", "-UP-")
+    # Only on the cut list and the bed, Ctrl+Z in the search box is for the text.
+    for element in (wazer_bed, cuts):
+        element.bind("<Control-z>", "+UNDO")
+        element.bind("<Control-y>", "+REDO")
     slider: sg.Slider = window["-SLIDER-"]
-    gcode = ""
     header = footer = parts = None
-    figure_mapping = {}
+    order: Optional[CutOrder] = None
+    catalog: Optional[FolderCatalog] = None
+    bed = BedCanvas(wazer_bed)
+    cache = ParseCache()
+    loader = FileLoader(window, cache, preview_tolerance=preview_tolerance(wazer_bed))
 
     # Main loop that responsed to events, and all that jazz
     while True:
+        profiler.event_finished()
         # time to use Structural Pattern Matching (SPM)
         # okay this got out of hand, lots of repitition in here
         # refactor and functionize this soon(tm)
-        match window.read():
+        match profiler.event_started(window.read()):
             case (sg.WIN_CLOSED, *_):
+                loader.close()
+                if catalog:
+                    catalog.close()
                 window.close()
                 return 0
             case ("-DOWN-", values):
@@ -341,44 +605,50 @@ def main() -> int:
                     files.update(set_to_index=max(0, files.get_indexes()[0] - 1))
                     window.write_event_value("-FILES-", files.get())
             case ("-foldername-", {"Select Folder": folder}):
-                files.update(values=list_files(folder))
+                if catalog:
+                    catalog.close()
+                catalog = FolderCatalog(folder)
+                files.update(values=catalog.search())
             case ("-GRAPH-", {"-GRAPH-": pos}):
-                idxs = ()
-                for x_wiggle in (-1, 0, 1):
-                    for y_wiggle in (-1, 0, 1):
-                        idxs += wazer_bed.get_figures_at_location((pos[0] + x_wiggle, pos[1] + y_wiggle))
-                locs = tuple(list(figure_mapping.values()).index(idx) for idx in idxs)
-                if locs:
-                    cuts.update(
-                        set_to_index=locs + cuts.get_indexes(),
-                        scroll_to_index=locs[0],
-                    )
-                for idx in locs:
-                    wazer_bed.tk_canvas.itemconfig(figure_mapping[idx], fill="red")
+                # A canvas doesn't take the focus by itself, and Ctrl+Z has to reach it.
+                wazer_bed.set_focus()
+                if None in pos or (loc := bed.cut_at(pos)) is None:
+                    continue
+                cuts.update(
+                    set_to_index=(loc,) + cuts.get_indexes(),
+                    scroll_to_index=loc,
+                )
+                bed.select(cuts.get_indexes())
             case ("-SLIDER-", {"-SLIDER-": pos}):
-                for idx, fig in enumerate(cuts.get_list_values()):
-                    if idx < pos:
-                        wazer_bed.tk_canvas.itemconfig(figure_mapping[fig], fill="red")
-                    else:
-                        wazer_bed.tk_canvas.itemconfig(figure_mapping[fig], fill="white smoke")
-                selected = tuple(x for x in range(0, int(pos)))
+                selected = tuple(x for x in range(0, min(int(pos), len(bed.figures))))
+                bed.select(selected)
                 cuts.update(set_to_index=selected, scroll_to_index=int(pos) - 1)
             case ("-FILES-", values):
                 if not values["-FILES-"]:
                     continue
-                gcode = read_file(Path(values["Select Folder"]) / values["-FILES-"][0])
-                header, footer, parts = parse_gcode(gcode)
+                names = files.get_list_values()
+                index = names.index(values["-FILES-"][0]) if values["-FILES-"][0] in names else -2
+                neighbours = [names[idx] for idx in (index - 1, index + 1) if 0 <= idx < len(names)]
+                window["-METADATA-"].update(value=f"Loading {values['-FILES-'][0]}...")
+                loader.load(
+                    Path(values["Select Folder"]) / values["-FILES-"][0],
+                    tuple(Path(values["Select Folder"]) / name for name in neighbours),
+                )
+            case ("-LOADED-", values):
+                path, parsed = values["-LOADED-"]
+                if not values["-FILES-"] or path != Path(values["Select Folder"]) / values["-FILES-"][0]:
+                    continue
+                header, footer, parts = parsed
                 if not all((header, footer, parts)):
                     sg.popup("File did not parse correctly.")
                     continue
-                window["-METADATA-"].update(value="\n".join(header.splitlines()[1:9]))
-                figure_mapping = draw_parts(parts, wazer_bed, slider)
-                cuts.update(values=figure_mapping)
+                order = CutOrder(parts)
+                window["-METADATA-"].update(value=metadata(header, footer, parts))
+                cuts.update(values=bed.draw(parts, slider))
             case ("Re-Draw", values):
                 if not all((header, footer, parts)):
                     continue
-                figure_mapping = draw_parts(parts, wazer_bed, slider)
-                cuts.update(values=figure_mapping)
+                cuts.update(values=bed.draw(parts, slider))
             case ("Rename", values):
                 if values["-FILES-"]:
                     if new_name := rename_popup(values["-FILES-"][0], values):
@@ -386,61 +656,106 @@ def main() -> int:
                             Path(values["Select Folder"]) / values["-FILES-"][0],
                             Path(values["Select Folder"]) / new_name,
                         )
-                        if "folder" in locals():
-                            files.update(values=list_files(folder, search=search_str))
+                        if catalog:
+                            # Straight away, a polling watcher could take a few seconds to see it.
+                            catalog.update(values["-FILES-"][0])
+                            catalog.update(new_name)
+                            files.update(values=catalog.search(values["-search-"]))
                             files.update(set_to_index=0)
                             window.write_event_value("-FILES-", files.get())
-            case ("Rearrange", *_):
+            case ("Rearrange", values):
                 if not all((header, footer, parts)):
                     continue
-                parts = reorder_parts(parts)
-                figure_mapping = draw_parts(parts, wazer_bed, slider)
-                cuts.update(values=figure_mapping)
-            case ("--REDRAW--", {"--REDRAW--": num}):
+                parts = reorder_parts(parts, values["-SHAPES-"])
+                order.replace(parts)
+                window["-METADATA-"].update(value=metadata(header, footer, parts))
+                cuts.update(values=bed.draw(parts, slider))
+            case ("Optimize", values):
                 if not all((header, footer, parts)):
                     continue
-                figure_mapping = draw_parts(parts, wazer_bed, slider)
-                new_ind = [limit(x + num, 0, len(cuts.get_list_values()) - 1) for x in cuts.get_indexes()]
-                scroll = 0 if not new_ind else min(new_ind)
-                cuts.update(values=figure_mapping, set_to_index=new_ind, scroll_to_index=scroll)
-                for fig in cuts.get_list_values():
-                    wazer_bed.tk_canvas.itemconfig(
-                        figure_mapping[fig],
-                        fill="white smoke" if fig not in cuts.get() else "red",
-                    )
+                before = rapid_distance(parts)
+                parts = optimize_travel(parts, shapes=values["-SHAPES-"])
+                order.replace(parts)
+                window["-METADATA-"].update(
+                    value=metadata(header, footer, parts)
+                    + f"\nRapid travel {before:.0f}mm -> {rapid_distance(parts):.0f}mm"
+                )
+                cuts.update(values=bed.draw(parts, slider))
+            case ("--MOVED--", {"--MOVED--": change}):
+                if not all((header, footer, parts, order, change)):
+                    continue
+                parts = order.current()
+                bed.reorder(change)
+                cuts.update(set_to_index=list(change.selected), scroll_to_index=min(change.selected, default=0))
+                bed.select(change.selected)
+                window["-METADATA-"].update(value=metadata(header, footer, parts))
+            case ("-DISKCACHE-", {"-DISKCACHE-": on_disk}):
+                cache.on_disk = on_disk
             case ("-CUTS-", values):
-                for fig in cuts.get_list_values():
-                    wazer_bed.tk_canvas.itemconfig(
-                        figure_mapping[fig],
-                        fill="white smoke" if fig not in cuts.get() else "red",
-                    )
-            case (event, values) if event in ("Up", "Down"):
-                val = -1 if event == "Up" else 1
-                if all((figure_mapping, parts)):
-                    for idx in cuts.get_indexes()[::-val]:
-                        if 0 <= idx + val < len(parts):
-                            parts[idx + val], parts[idx] = parts[idx], parts[idx + val]
-                    window.write_event_value("--REDRAW--", val)
+                bed.select(cuts.get_indexes())
+            case (event, values) if event in ("-GRAPH-+UNDO", "-CUTS-+UNDO", "-GRAPH-+REDO", "-CUTS-+REDO"):
+                window.write_event_value("Undo" if event.endswith("UNDO") else "Redo", None)
+            case (event, values) if event in ("Up", "Down", "To Front", "To Back", "Move To", "Undo", "Redo"):
+                if not all((bed.figures, parts, order)):
+                    continue
+                selected = cuts.get_indexes()
+                match event:
+                    case "Up" | "Down":
+                        change = order.step(selected, -1 if event == "Up" else 1)
+                    case "To Front":
+                        change = order.to_front(selected)
+                    case "To Back":
+                        change = order.to_back(selected)
+                    case "Move To":
+                        if not selected:
+                            continue
+                        target = sg.popup_get_text("Move the selected cuts to position", default_text=str(selected[0]))
+                        if not (target or "").strip().isdigit():
+                            continue
+                        change = order.move(selected, int(target))
+                    case "Undo":
+                        change = order.undo()
+                    case "Redo":
+                        change = order.redo()
+                window.write_event_value("--MOVED--", change)
             case ("Save Copy", values):
                 if all((values["-FILES-"], header, footer, parts)):
-                    write_file(
-                        Path(values["Select Folder"]) / values["-FILES-"][0],
-                        header,
-                        footer,
-                        parts,
-                    )
-                    window.write_event_value("-search-", values["-search-"])
+                    original = Path(values["Select Folder"]) / values["-FILES-"][0]
+                    tolerance = COMPACT_TOLERANCE_MM if values["-COMPACT-"] else 0.0
+                    # Writing and checking a big file takes seconds, so it goes to the loader's workers.
+                    window["Save Copy"].update(disabled=True)
+                    window["-METADATA-"].update(value=f"{metadata(header, footer, parts)}\nSaving t_{original.name}...")
+                    loader.save(original, header, footer, parts, tolerance)
+            case ("-SAVED-", values):
+                original, tolerance, result = values["-SAVED-"]
+                window["Save Copy"].update(disabled=False)
+                if isinstance(result, Exception):
+                    sg.popup(f"Couldn't save t_{original.name}!\n{result}")
+                    continue
+                compaction, verification = result
+                text = metadata(header, footer, parts) if all((header, footer, parts)) else original.name
+                if tolerance:
+                    text += f"\nCompacted {compaction.lines_removed} lines, {compaction.bytes_saved} bytes"
+                window["-METADATA-"].update(value=f"{text}\n{verification}")
+                if not verification.ok:
+                    sg.popup(f"t_{original.name} doesn't match {original.name}!\n{verification}")
+                if catalog:
+                    catalog.update(f"t_{original.name}")
+                window.write_event_value("-search-", values["-search-"])
             case ("Delete", values):
                 if all((values["-FILES-"], header, footer, parts)):
                     if sg.popup_ok_cancel("Delete selected file?") == "OK":
                         os.remove(Path(values["Select Folder"]) / values["-FILES-"][0])
+                        if catalog:
+                            catalog.update(values["-FILES-"][0])
                         window.write_event_value("-search-", values["-search-"])
             case ("-search-", {"-search-": search_str}):
-                if "folder" in locals():
+                if catalog:
                     prev_index = files.get_indexes()
+                    prev_select = None
                     if prev_index:
                         prev_select = files.get_list_values()[prev_index[0]]
-                    files.update(values=list_files(folder, search=search_str))
+                    files.update(values=catalog.search(search_str))
                     if prev_select in files.get_list_values():
                         files.update(set_to_index=files.get_list_values().index(prev_select))
                     elif prev_index:
@@ -0,0 +1,152 @@
+"""
+Opt-in timing for the GUI event loop, and the core functions under it.
+
+Off unless WAM_PROFILE is set or wam_decode.py gets --profile. When it is off
+nothing gets wrapped, the event loop makes two calls per event that return
+straight away and that is it.
+
+    WAM_PROFILE=1 python wam_decode.py                 summary on exit
+    WAM_PROFILE=trace.json python wam_decode.py        summary and a Chrome trace
+    python wam_decode.py --profile trace.json
+
+The trace opens in chrome://tracing or https://ui.perfetto.dev, worker thread
+parses show up on their own rows.
+"""
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+ENV_VAR = "WAM_PROFILE"
+
+
+class Profiler:
+    """Rolling latencies per event or function name, and a Chrome trace of every span.
+
+    Only the last window latencies of each name are kept, so the histogram is of
+    how it has been lately, not since start up. The trace is capped at max_trace spans.
+    Spans can come from any thread.
+    """
+
+    # Upper edges of the histogram buckets, anything slower goes in the last one.
+    BUCKETS_MS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+    def __init__(
+        self, enabled: bool = False, trace_path: Optional[str] = None, window: int = 1000, max_trace: int = 200_000
+    ):
+        self.enabled = enabled
+        self.trace_path = trace_path
+        self.window = window
+        self.latencies: dict[str, deque] = {}
+        self.trace: deque = deque(maxlen=max_trace)
+        self.lock = threading.Lock()
+        self.started = time.perf_counter_ns()
+        self.current: Optional[tuple[str, int]] = None
+
+    @classmethod
+    def configure(cls, setting: Optional[str] = None) -> "Profiler":
+        """Profiler from a --profile value, or WAM_PROFILE when there wasn't one.
+
+        Unset, empty or 0 is off, a .json name is on with a trace, anything else is on.
+        """
+        setting = os.environ.get(ENV_VAR, "") if setting is None else setting or "1"
+        if setting in ("", "0"):
+            return cls()
+        return cls(enabled=True, trace_path=setting if setting.lower().endswith(".json") else None)
+
+    def record(self, name: str, category: str, start_ns: int, end_ns: int):
+        with self.lock:
+            self.latencies.setdefault(name, deque(maxlen=self.window)).append((end_ns - start_ns) / 1e9)
+            if self.trace_path:
+                self.trace.append(
+                    {
+                        "name": name,
+                        "cat": category,
+                        "ph": "X",
+                        "ts": (start_ns - self.started) / 1e3,
+                        "dur": (end_ns - start_ns) / 1e3,
+                        "pid": os.getpid(),
+                        "tid": threading.get_ident(),
+                    }
+                )
+
+    @contextmanager
+    def span(self, name: str, category: str = "call"):
+        """Time the with block under name"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record(name, category, start, time.perf_counter_ns())
+
+    def wrap(self, func, name: str):
+        """func, timed under name every time it is called"""
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            with self.span(name):
+                return func(*args, **kwargs)
+
+        return timed
+
+    def instrument(self, owner, *names: str):
+        """Swap the named functions of a module or class for timed ones, only when enabled.
+
+        Modules that did a from import hold their own reference, so they need doing too.
+        Spans are named by the function's qualified name, like BedCanvas.draw.
+        """
+        if not self.enabled:
+            return
+        for name in names:
+            func = getattr(owner, name)
+            setattr(owner, name, self.wrap(func, func.__qualname__))
+
+    def event_started(self, read: tuple) -> tuple:
+        """Start timing the event window.read() gave back, and pass it through"""
+        if self.enabled:
+            self.current = (str(read[0]), time.perf_counter_ns())
+        return read
+
+    def event_finished(self):
+        """The event being handled is done, call it before reading the next one"""
+        if self.current:
+            name, start = self.current
+            self.record(name, "event", start, time.perf_counter_ns())
+            self.current = None
+
+    def summary(self) -> str:
+        """Table of every name, slowest total first, with its recent latency histogram"""
+        with self.lock:
+            latencies = {name: sorted(times) for name, times in self.latencies.items()}
+        edges = [f"<{edge}" for edge in self.BUCKETS_MS] + [f">={self.BUCKETS_MS[-1]}"]
+        lines = [f"{'name':40}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}  histogram ms"]
+        for name, times in sorted(latencies.items(), key=lambda item: -sum(item[1])):
+            buckets = [0] * len(edges)
+            for secs in times:
+                buckets[next((idx for idx, edge in enumerate(self.BUCKETS_MS) if secs * 1e3 < edge), -1)] += 1
+            histogram = " ".join(f"{edge}:{count}" for edge, count in zip(edges, buckets) if count)
+            p50, p95 = times[len(times) // 2], times[min(len(times) - 1, int(len(times) * 0.95))]
+            stats = f"{len(times):>7}{p50 * 1e3:>9.2f}{p95 * 1e3:>9.2f}{times[-1] * 1e3:>9.2f}"
+            lines.append(f"{name:40}{stats}  {histogram}")
+        return "\n".join(lines)
+
+    def dump(self):
+        """Print the summary to stderr, and write the trace if there is one"""
+        if not self.enabled:
+            return
+        print(self.summary(), file=sys.stderr)
+        if self.trace_path:
+            with self.lock:
+                events = list(self.trace)
+            with open(self.trace_path, "w", encoding="utf-8") as file:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+            print(f"Trace written to {self.trace_path}", file=sys.stderr)
@@ -6,13 +6,35 @@ which was based on https://gist.github.com/mrh1997/717b14f5783b49ca14310419fa7f0
 
 
 RESOURCE: https://docs.microsoft.com/en-us/windows/win32/api/wincred/ns-wincred-credentialw
+
+Reads go through an in-process cache, so looking the same target up over and
+over only reaches the Credential Manager once every CredentialCache.ttl seconds.
+Creating or deleting a credential through this module drops its cached entry.
+
+get_generic_credentials fetches every credential matching a filter in one
+CredEnumerateW call, and leaves them all in the cache, for warming a service up.
+
+Where the credentials come from is a backend. WindowsBackend is the default,
+MemoryBackend or FileBackend stand in for it anywhere else:
+
+    set_backend(MemoryBackend())
+    set_backend(FileBackend("creds.json"))
 """
 import ctypes as ct
 import ctypes.wintypes as wt
+import fnmatch
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
 from enum import Enum
-from typing import NamedTuple, Optional
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, NamedTuple, Optional, Protocol
 
 LP_BYTE = ct.POINTER(wt.BYTE)
+ERROR_NOT_FOUND = 1168
 
 Credential = NamedTuple("Credential", [("username", str), ("password", str)])
 
@@ -57,6 +79,375 @@ class WinCredential(ct.Structure):
     ]
 
 
+@lru_cache(maxsize=None)
+def _advapi32() -> ct.CDLL:
+    """Advapi32.dll with the Cred* prototypes set, loaded the first time it is needed."""
+    advapi32 = ct.WinDLL("Advapi32.dll", use_last_error=True)
+    advapi32.CredWriteW.restype = wt.BOOL
+    advapi32.CredWriteW.argtypes = [ct.POINTER(WinCredential), wt.DWORD]
+    advapi32.CredDeleteW.restype = wt.BOOL
+    advapi32.CredDeleteW.argtypes = [wt.LPCWSTR, wt.DWORD, wt.DWORD]
+    advapi32.CredReadW.restype = wt.BOOL
+    advapi32.CredReadW.argtypes = [
+        wt.LPCWSTR,
+        wt.DWORD,
+        wt.DWORD,
+        ct.POINTER(ct.POINTER(WinCredential)),  # CredReadW hands back a pointer it allocated
+    ]
+    advapi32.CredEnumerateW.restype = wt.BOOL
+    advapi32.CredEnumerateW.argtypes = [
+        wt.LPCWSTR,
+        wt.DWORD,
+        ct.POINTER(wt.DWORD),
+        ct.POINTER(ct.POINTER(ct.POINTER(WinCredential))),  # CredEnumerateW hands back an array of them
+    ]
+    advapi32.CredFree.restype = None
+    advapi32.CredFree.argtypes = [ct.c_void_p]
+    return advapi32
+
+
+class CredentialBackend(Protocol):
+    """Where generic credentials are kept. Target names are case insensitive, like in Windows."""
+
+    def read(self, target_name: str) -> Optional[Credential]:
+        ...
+
+    def write(self, target_name: str, username: str, password: str) -> None:
+        ...
+
+    def delete(self, target_name: str) -> None:
+        ...
+
+    def read_many(self, target_filter: Optional[str] = None) -> dict[str, Credential]:
+        ...
+
+    def write_many(self, credentials: dict[str, Credential]) -> None:
+        ...
+
+
+class WindowsBackend:
+    """The Windows Credential Manager, through Advapi32.dll"""
+
+    def read(self, target_name: str) -> Optional[Credential]:
+        """
+        Reads a generic credential.
+
+        Args:
+            target_name (str): The name of the generic credential to retrieve.
+
+        Returns:
+            Optional[Credential]: The retrieved credential if found, or None if not found.
+        """
+        advapi32 = _advapi32()
+        cred_ptr = ct.POINTER(WinCredential)()
+        if advapi32.CredReadW(target_name, CredType.GENERIC.value, 0, ct.byref(cred_ptr)):
+            try:
+                return self.decode(cred_ptr.contents)
+            finally:
+                advapi32.CredFree(cred_ptr)
+        return None
+
+    def read_many(self, target_filter: Optional[str] = None) -> dict[str, Credential]:
+        """
+        Reads every generic credential matching a filter, with one CredEnumerateW and one CredFree.
+
+        Args:
+            target_filter (Optional[str]): A target name prefix ending in *, like "myservice/*", or None for all.
+
+        Raises:
+            OSError: If the enumeration fails for any reason but there being no match.
+
+        Returns:
+            dict[str, Credential]: Credentials by target name, empty if nothing matched.
+        """
+        advapi32 = _advapi32()
+        count = wt.DWORD()
+        creds = ct.POINTER(ct.POINTER(WinCredential))()
+        if not advapi32.CredEnumerateW(target_filter, 0, ct.byref(count), ct.byref(creds)):
+            error = ct.get_last_error()
+            if error == ERROR_NOT_FOUND:
+                return {}
+            raise ct.WinError(error)
+        try:
+            found = {}
+            for idx in range(count.value):
+                cred = creds[idx].contents
+                if cred.Type == CredType.GENERIC.value:
+                    found[cred.TargetName] = self.decode(cred)
+            return found
+        finally:
+            advapi32.CredFree(creds)
+
+    @staticmethod
+    def decode(cred: WinCredential) -> Credential:
+        """The username and password out of a _CREDENTIALW, copied before it gets freed"""
+        cred_str = ct.string_at(cred.CredentialBlob, cred.CredentialBlobSize)
+        password = cred_str.decode("utf-16le", errors="ignore")
+        return Credential(cred.UserName, password)
+
+    def write(self, target_name: str, username: str, password: str) -> None:
+        """
+        Creates or updates a generic credential.
+
+        Args:
+            target_name (str): The name of the target for the credential.
+            username (str): The username for the credential.
+            password (str): The password for the credential.
+
+        Raises:
+            OSError: If the credential creation fails.
+        """
+        credential = WinCredential()
+        credential.Type = CredType.GENERIC.value
+        credential.TargetName = target_name
+        credential.CredentialBlobSize = len(password.encode("utf-16-le") + b"\x00")
+        credential.CredentialBlob = ct.cast(
+            ct.create_string_buffer(password.encode("utf-16-le") + b"\x00"),
+            LP_BYTE,
+        )
+        credential.Persist = Persist.LOCAL_MACHINE.value
+        credential.UserName = username
+        if not _advapi32().CredWriteW(ct.byref(credential), 0):
+            raise ct.WinError(ct.get_last_error())
+
+    def delete(self, target_name: str) -> None:
+        """
+        Deletes a generic credential.
+
+        Args:
+            target_name (str): The target name of the credential to delete.
+
+        Raises:
+            OSError: If the credential deletion fails.
+        """
+        if not _advapi32().CredDeleteW(target_name, CredType.GENERIC.value, 0):
+            raise ct.WinError(ct.get_last_error())
+
+    def write_many(self, credentials: dict[str, Credential]) -> None:
+        """
+        Creates or updates several generic credentials. There is no bulk CredWriteW, so it is one call each.
+
+        Args:
+            credentials (dict[str, Credential]): Username and password by target name.
+
+        Raises:
+            OSError: On the first one that fails, the ones before it stay written.
+        """
+        for target_name, (username, password) in credentials.items():
+            self.write(target_name, username, password)
+
+
+class MemoryBackend:
+    """Generic credentials in a dict, for running without Windows.
+
+    Passwords come back exactly as they were written, like from WindowsBackend,
+    where the odd NUL byte written after the UTF-16 gets dropped on the way back.
+    Filters are fnmatch patterns, which covers the prefix* ones CredEnumerateW takes.
+    """
+
+    def __init__(self):
+        # Lower cased target name to the name as written, and the credential.
+        self.credentials: dict[str, tuple[str, Credential]] = {}
+        self.lock = threading.RLock()
+
+    def read(self, target_name: str) -> Optional[Credential]:
+        with self.lock:
+            entry = self.credentials.get(target_name.lower())
+        return entry[1] if entry else None
+
+    def write(self, target_name: str, username: str, password: str) -> None:
+        self.write_many({target_name: Credential(username, password)})
+
+    def delete(self, target_name: str) -> None:
+        with self.lock:
+            if self.credentials.pop(target_name.lower(), None) is None:
+                raise FileNotFoundError(f"No credential named {target_name}")
+
+    def read_many(self, target_filter: Optional[str] = None) -> dict[str, Credential]:
+        pattern = (target_filter or "*").lower()
+        with self.lock:
+            return {
+                name: credential
+                for key, (name, credential) in self.credentials.items()
+                if fnmatch.fnmatchcase(key, pattern)
+            }
+
+    def write_many(self, credentials: dict[str, Credential]) -> None:
+        with self.lock:
+            for target_name, (username, password) in credentials.items():
+                self.credentials[target_name.lower()] = (target_name, Credential(username, password))
+
+
+class FileBackend(MemoryBackend):
+    """MemoryBackend kept in a JSON file, so separate processes see the same credentials.
+
+    The file is read before and written after every operation, a write_many is
+    one read and one write however many credentials it has. Passwords are in the
+    file as plain text, it is a stand-in for tests and benchmarks, not a vault.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = Path(path)
+
+    def load(self):
+        try:
+            stored = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            stored = {}
+        self.credentials = {name.lower(): (name, Credential(*credential)) for name, credential in stored.items()}
+
+    def save(self):
+        temp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        temp.write_text(json.dumps({name: credential for name, credential in self.credentials.values()}), "utf-8")
+        os.replace(temp, self.path)
+
+    def read(self, target_name: str) -> Optional[Credential]:
+        with self.lock:
+            self.load()
+            return super().read(target_name)
+
+    def delete(self, target_name: str) -> None:
+        with self.lock:
+            self.load()
+            super().delete(target_name)
+            self.save()
+
+    def read_many(self, target_filter: Optional[str] = None) -> dict[str, Credential]:
+        with self.lock:
+            self.load()
+            return super().read_many(target_filter)
+
+    def write_many(self, credentials: dict[str, Credential]) -> None:
+        with self.lock:
+            self.load()
+            super().write_many(credentials)
+            self.save()
+
+
+class CredentialCache:
+    """Thread-safe read cache in front of a backend, entries expire after ttl seconds.
+
+    When there are more than max_size entries the least recently read one is
+    dropped. Lookups that found nothing are not cached. A ttl or max_size of 0
+    turns the cache off.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_size: int = 256, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        self.entries: OrderedDict[str, tuple[float, Credential]] = OrderedDict()
+        self.lock = threading.Lock()
+        # Bumped by every invalidate, so a read that was under way can't put back what was just dropped.
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, target_name: str, load: Callable[[str], Optional[Credential]]) -> Optional[Credential]:
+        """
+        The cached credential for target_name, or what load gives back for it.
+
+        Args:
+            target_name (str): The name of the credential.
+            load (Callable): Reads the credential when it isn't cached, or has expired.
+
+        Returns:
+            Optional[Credential]: The credential if found, or None if not found.
+        """
+        key = target_name.lower()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.entries.pop(key, None)
+            self.misses += 1
+            generation = self.generation
+        credential = load(target_name)
+        if credential is None or self.ttl <= 0 or self.max_size <= 0:
+            return credential
+        with self.lock:
+            if generation == self.generation:
+                self.entries[key] = (self.clock() + self.ttl, credential)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+        return credential
+
+    def get_many(self, load: Callable[[], dict[str, Credential]]) -> dict[str, Credential]:
+        """
+        Everything load gives back, cached as if each one had been read on its own.
+
+        Args:
+            load (Callable): Reads a batch of credentials, by target name.
+
+        Returns:
+            dict[str, Credential]: What load gave back.
+        """
+        with self.lock:
+            generation = self.generation
+        credentials = load()
+        if self.ttl <= 0 or self.max_size <= 0:
+            return credentials
+        with self.lock:
+            if generation == self.generation:
+                expires = self.clock() + self.ttl
+                for target_name, credential in credentials.items():
+                    key = target_name.lower()
+                    self.entries[key] = (expires, credential)
+                    self.entries.move_to_end(key)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+        return credentials
+
+    def invalidate(self, target_name: str) -> None:
+        """Drop target_name, the next read goes to the backend"""
+        with self.lock:
+            self.entries.pop(target_name.lower(), None)
+            self.generation += 1
+
+    def clear(self) -> None:
+        """Drop everything"""
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+
+_backend: Optional[CredentialBackend] = None
+_cache = CredentialCache()
+
+
+def get_backend() -> CredentialBackend:
+    """The backend in use, WindowsBackend unless set_backend was given another"""
+    global _backend  # pylint: disable=global-statement
+    if _backend is None:
+        _backend = WindowsBackend()
+    return _backend
+
+
+def set_backend(backend: CredentialBackend, cache: Optional[CredentialCache] = None) -> None:
+    """
+    Swaps the backend, and the cache in front of it.
+
+    Args:
+        backend (CredentialBackend): Where credentials are read from and written to.
+        cache (Optional[CredentialCache]): A new cache, or None to keep the current one, emptied.
+    """
+    global _backend, _cache  # pylint: disable=global-statement
+    _backend = backend
+    if cache is None:
+        _cache.clear()
+    else:
+        _cache = cache
+
+
+def get_cache() -> CredentialCache:
+    """The cache in front of the backend, to change its ttl or max_size"""
+    return _cache
+
+
 def create_generic_credential(target_name: str, username: str, password: str) -> None:
     """
     Creates or updates a generic credential in the Windows Credential Manager.
@@ -72,22 +463,10 @@ def create_generic_credential(target_name: str, username: str, password: str) ->
     Returns:
         None
     """
-    advapi32 = ct.WinDLL("Advapi32.dll")
-    advapi32.CredWriteW.restype = wt.BOOL
-    advapi32.CredWriteW.argtypes = [ct.POINTER(WinCredential), wt.DWORD]
-
-    credential = WinCredential()
-    credential.Type = CredType.GENERIC.value
-    credential.TargetName = target_name
-    credential.CredentialBlobSize = len(password.encode("utf-16-le") + b"\x00")
-    credential.CredentialBlob = ct.cast(
-        ct.create_string_buffer(password.encode("utf-16-le") + b"\x00"),
-        ct.POINTER(ct.c_ubyte),
-    )
-    credential.Persist = Persist.LOCAL_MACHINE.value
-    credential.UserName = username
-    if not advapi32.CredWriteW(ct.byref(credential), 0):
-        raise ct.WinError(ct.get_last_error())
+    try:
+        get_backend().write(target_name, username, password)
+    finally:
+        _cache.invalidate(target_name)
 
 
 def delete_generic_credential(target_name: str) -> None:
@@ -100,12 +479,10 @@ def delete_generic_credential(target_name: str) -> None:
         OSError: If the credential deletion fails.
 
     """
-    advapi32 = ct.WinDLL("Advapi32.dll")
-    advapi32.CredDeleteW.restype = wt.BOOL
-    advapi32.CredDeleteW.argtypes = [wt.LPCWSTR, wt.DWORD, wt.DWORD]
-
-    if not advapi32.CredDeleteW(target_name, CredType.GENERIC.value, 0):
-        raise ct.WinError(ct.get_last_error())
+    try:
+        get_backend().delete(target_name)
+    finally:
+        _cache.invalidate(target_name)
 
 
 def get_generic_credential(name: str) -> Optional[Credential]:
@@ -118,24 +495,37 @@ def get_generic_credential(name: str) -> Optional[Credential]:
     Returns:
         Optional[Credential]: The retrieved credential if found, or None if not found.
     """
-    advapi32 = ct.WinDLL("Advapi32.dll")
-    advapi32.CredReadW.restype = wt.BOOL
-    advapi32.CredReadW.argtypes = [
-        wt.LPCWSTR,
-        wt.DWORD,
-        wt.DWORD,
-        ct.POINTER(ct.POINTER(WinCredential)),  ## <-- why the double wrap? I'm so confused.
-    ]
+    return _cache.get(name, get_backend().read)
 
-    cred_ptr = ct.POINTER(WinCredential)()
-    if advapi32.CredReadW(name, CredType.GENERIC.value, 0, ct.byref(cred_ptr)):
-        try:
-            username = cred_ptr.contents.UserName
-            cred_blob = cred_ptr.contents.CredentialBlob
-            cred_blob_size = cred_ptr.contents.CredentialBlobSize
-            cred_str = ct.string_at(cred_blob, cred_blob_size)
-            password = cred_str.decode("utf-16le", errors="ignore")
-            return Credential(username, password)
-        finally:
-            advapi32.CredFree(cred_ptr)
-    return None
+
+def get_generic_credentials(target_filter: Optional[str] = None) -> dict[str, Credential]:
+    """
+    Retrieves every generic credential matching a filter in one go, and caches them all.
+
+    Args:
+        target_filter (Optional[str]): A target name prefix ending in *, like "myservice/*", or None for all.
+
+    Raises:
+        OSError: If the enumeration fails.
+
+    Returns:
+        dict[str, Credential]: The credentials found, by target name.
+    """
+    return _cache.get_many(lambda: get_backend().read_many(target_filter))
+
+
+def create_generic_credentials(credentials: dict[str, Credential]) -> None:
+    """
+    Creates or updates several generic credentials.
+
+    Args:
+        credentials (dict[str, Credential]): Username and password by target name.
+
+    Raises:
+        OSError: If writing any of them fails.
+    """
+    try:
+        get_backend().write_many(credentials)
+    finally:
+        for target_name in credentials:
+            _cache.invalidate(target_name)